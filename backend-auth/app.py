@@ -11,14 +11,16 @@ import psycopg2
 import sys
 sys.path.append('/app/shared')
 from rabbitmq_client import RabbitMQ
+import log_utils
 
 app = Flask(__name__)
 app.config.from_pyfile('config.cfg')
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'fallback-secret-for-development-only')
 db = SQLAlchemy(app)
+log = log_utils.get_logger('auth-service')
 
 rabbitmq_producer = RabbitMQ('auth-service', 'user_events') 
-rabbitmq_consumer = RabbitMQ('auth-service', 'user_crud_events')
+rabbitmq_consumer = RabbitMQ('auth-service', 'user_crud_events', group='auth-service')
 
 class Auth(db.Model):
     auth_id = db.Column(db.Integer, primary_key=True)
@@ -41,12 +43,12 @@ def handle_user_crud_message(message):
                 password = data.get("password")
                 
                 if auth_id is None:
-                    print("Error: auth_id is required for profile update", flush=True)
+                    log.error("Error: auth_id is required for profile update")
                     return
                 
                 auth_record = db.session.execute(db.select(Auth).filter_by(auth_id=auth_id)).scalar()
                 if not auth_record:
-                    print(f"Error: Auth record not found for auth_id: {auth_id}", flush=True)
+                    log.error("Error: Auth record not found for auth_id: %s", auth_id)
                     return
                 
                 if username:
@@ -57,10 +59,10 @@ def handle_user_crud_message(message):
                     auth_record.password = generate_password_hash(password)
                 
                 db.session.commit()
-                print(f"Auth profile updated successfully via message: {auth_record.username}", flush=True)
+                log.info("Auth profile updated successfully via message: %s", auth_record.username)
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to update auth profile via message: {str(e)}", flush=True)
+                log.error("Failed to update auth profile via message: %s", e)
         
         elif message_type == 'delete_auth':
             try:
@@ -69,12 +71,12 @@ def handle_user_crud_message(message):
                 if auth_record:
                     db.session.delete(auth_record)
                     db.session.commit()
-                    print(f"Auth record deleted successfully via message: {auth_id}", flush=True)
+                    log.info("Auth record deleted successfully via message: %s", auth_id)
                 else:
-                    print(f"Auth record not found for deletion: {auth_id}", flush=True)
+                    log.warning("Auth record not found for deletion: %s", auth_id)
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to delete auth record via message: {str(e)}", flush=True)
+                log.error("Failed to delete auth record via message: %s", e)
 
 rabbitmq_consumer.consumeMessage(handle_user_crud_message)
 
@@ -122,10 +124,10 @@ def register():
         db.session.commit()
 
         user_payload = {"auth_id": auth_record.auth_id, "username": username, "email": email, "role": role}
-        rabbitmq_producer.sendMessage('create_user', user_payload)
+        rabbitmq_producer.sendMessageAsync('create_user', user_payload)
 
         device_payload = {"auth_id": auth_record.auth_id}
-        rabbitmq_producer.sendMessage('add_user', device_payload)
+        rabbitmq_producer.sendMessageAsync('add_user', device_payload)
 
         token_payload = {
             'auth_id': auth_record.auth_id,
@@ -142,7 +144,7 @@ def register():
         )
         
     except Exception as e:
-        print(f'Exception: {e}', flush=True)
+        log.exception('Exception: %s', e)
         db.session.rollback()
         response = {"error": f"Failed to create account: {str(e)}"}
         return app.response_class(
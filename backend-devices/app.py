@@ -11,13 +11,15 @@ import psycopg2
 import sys
 sys.path.append('/app/shared')
 from rabbitmq_client import RabbitMQ
+import log_utils
 
 app = Flask(__name__)
 app.config.from_pyfile('config.cfg')
 db = SQLAlchemy(app)
+log = log_utils.get_logger('device-service')
 
-rabbitmq_auth_consumer = RabbitMQ('device-service', 'user_events')  
-rabbitmq_user_consumer = RabbitMQ('device-service', 'user_crud_events')  
+rabbitmq_auth_consumer = RabbitMQ('device-service', 'user_events', group='device-service')
+rabbitmq_user_consumer = RabbitMQ('device-service', 'user_crud_events', group='device-service')
 rabbitmq_monitoring_producer = RabbitMQ('device-service', 'device_crud')  
 
 class Device(db.Model):
@@ -32,6 +34,17 @@ class Device(db.Model):
 class Users(db.Model):
     auth_id = db.Column(db.Integer, primary_key=True)
 
+def device_event(device):
+    # Device events carry the whole device so subscribers can keep a local copy
+    # without refetching /devices.
+    return {
+        'device_id': device.device_id,
+        'auth_id': device.auth_id,
+        'name': device.name,
+        'status': device.status,
+        'maxConsumption': device.consumption
+    }
+
 def handle_auth_message(message):
     message_type = message.get('type')
     data = message.get('data', {})
@@ -43,16 +56,16 @@ def handle_auth_message(message):
                 
                 existing_user = db.session.execute(db.select(Users).filter_by(auth_id=auth_id)).scalar()
                 if existing_user:
-                    print(f"User with auth_id {auth_id} already exists in device service, skipping duplicate creation", flush=True)
+                    log.info("User with auth_id %s already exists in device service, skipping duplicate creation", auth_id)
                     return
                 
                 user_record = Users(auth_id=auth_id)
                 db.session.add(user_record)
                 db.session.commit()
-                print(f"User added to device service via auth message: {auth_id}", flush=True)
+                log.info("User added to device service via auth message: %s", auth_id)
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to add user to device service via auth message: {str(e)}", flush=True)
+                log.error("Failed to add user to device service via auth message: %s", e)
 
 def handle_user_crud_message(message):
     message_type = message.get('type')
@@ -62,9 +75,9 @@ def handle_user_crud_message(message):
         if message_type == 'update_user_in_devices':
             try:
                 auth_id = data.get("auth_id")
-                print(f"User updated in device service via user message: {auth_id}", flush=True)
+                log.info("User updated in device service via user message: %s", auth_id)
             except Exception as e:
-                print(f"Failed to update user in device service via user message: {str(e)}", flush=True)
+                log.error("Failed to update user in device service via user message: %s", e)
         
         elif message_type == 'delete_device_user':
             try:
@@ -73,10 +86,10 @@ def handle_user_crud_message(message):
                 if user_record:
                     db.session.delete(user_record)
                     db.session.commit()
-                    print(f"User and devices deleted from device service via user message: {auth_id}", flush=True)
+                    log.info("User and devices deleted from device service via user message: %s", auth_id)
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to delete user from device service via user message: {str(e)}", flush=True)
+                log.error("Failed to delete user from device service via user message: %s", e)
 
 
 rabbitmq_auth_consumer.consumeMessage(handle_auth_message)
@@ -124,7 +137,7 @@ def get_users():
             "status": device.status,
             "maxConsumption": device.consumption
         })
-        print(device_list[-1], flush=True)
+    log.debug("Fetched %d devices", len(device_list))
     response = {'ok': 'Devices fetched!', 'devices': device_list}
     return app.response_class(
         response=json.dumps(response),
@@ -200,10 +213,7 @@ def add_device():
             mimetype='application/json'
         )
     db.session.commit()
-    rabbitmq_monitoring_producer.sendMessage('add_device', {
-        'device_id': device.device_id,
-        'auth_id': device.auth_id,
-    })
+    rabbitmq_monitoring_producer.sendMessageAsync('add_device', device_event(device))
     response = {"ok": "Device created"}
     return app.response_class(
             response=json.dumps(response),
@@ -254,6 +264,7 @@ def edit_device():
             device.auth_id = int(assigned_to)
 
         db.session.commit()
+        rabbitmq_monitoring_producer.sendMessageAsync('update_device', device_event(device))
 
         response = {"ok": "Device updated successfully"}
         return app.response_class(
@@ -296,7 +307,7 @@ def delete_device():
 
         db.session.delete(device)
         db.session.commit()
-        rabbitmq_monitoring_producer.sendMessage('delete_device', {
+        rabbitmq_monitoring_producer.sendMessageAsync('delete_device', {
             'device_id': device_id
         })
 
@@ -345,6 +356,8 @@ def remove_user():
             device.auth_id = -1  
         
         db.session.commit()
+        for device in devices:
+            rabbitmq_monitoring_producer.sendMessageAsync('update_device', device_event(device))
 
         response = {"ok": f"User {auth_id} removed and devices unassigned"}
         return app.response_class(
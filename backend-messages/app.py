@@ -11,12 +11,14 @@ import sys
 import requests
 sys.path.append('/app/shared')
 from rabbitmq_client import RabbitMQ
+import log_utils
 
 app = Flask(__name__)
 CORS(app)
 app.config.from_pyfile('config.cfg')
 
 db = SQLAlchemy(app)
+log = log_utils.get_logger('messages-service')
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', logger=True, engineio_logger=True)
 
 rabbitmq_alert_consumer = RabbitMQ('messages-service', 'overconsumption_alerts', host='rabbitmq-service')
@@ -94,14 +96,14 @@ def get_ai_response(message, context=""):
             message_content = result.get('choices', [{}])[0].get('message', {}).get('content', '').strip()
             return message_content or "AI response generated but empty."
         else:
-            print(f"HF API Error: {response.status_code} {response.text}", flush=True)
+            log.error("HF API Error: %s %s", response.status_code, response.text)
             return "I'm sorry, I'm having trouble connecting to my knowledge base right now. Please try again later or contact support."
     except Exception as e:
-        print(f"AI Error: {e}", flush=True)
+        log.error("AI Error: %s", e)
         return "I'm sorry, I'm having trouble connecting to my knowledge base right now. Please try again later or contact support."
 
 def handle_overconsumption_alert(message):
-    print(f"[ALERT HANDLER] Received message: {message}", flush=True)
+    log.debug("[ALERT HANDLER] Received message: %s", message)
     message_type = message.get('type')
     data = message.get('data', {})
     
@@ -115,7 +117,7 @@ def handle_overconsumption_alert(message):
                 
                 alert_message = f"ALERT: Device {device_id} has exceeded its consumption limit! Current: {consumption:.2f} kWh, Maximum allowed: {threshold:.2f} kWh"
                 
-                print(f"[ALERT HANDLER] Processing overconsumption alert for user {user_id}, device {device_id}", flush=True)
+                log.info("[ALERT HANDLER] Processing overconsumption alert for user %s, device %s", user_id, device_id)
                 
                 socketio.emit('overconsumption_notification', {
                     'user_id': user_id,
@@ -126,37 +128,35 @@ def handle_overconsumption_alert(message):
                     'timestamp': datetime.now(UTC).isoformat()
                 })
                 
-                print(f"[ALERT HANDLER] Overconsumption notification broadcast for user {user_id}", flush=True)
+                log.info("[ALERT HANDLER] Overconsumption notification broadcast for user %s", user_id)
                 
             except Exception as e:
-                print(f"[ALERT HANDLER] Error handling overconsumption alert: {str(e)}", flush=True)
-                import traceback
-                traceback.print_exc()
+                log.exception("[ALERT HANDLER] Error handling overconsumption alert: %s", e)
 
-print("[INIT] Registering RabbitMQ consumer for overconsumption_alerts...", flush=True)
+log.info("[INIT] Registering RabbitMQ consumer for overconsumption_alerts...")
 rabbitmq_alert_consumer.consumeMessage(handle_overconsumption_alert)
-print("[INIT] RabbitMQ consumer registered successfully", flush=True)
+log.info("[INIT] RabbitMQ consumer registered successfully")
 
 rabbitmq_alert_consumer.consumeMessage(handle_overconsumption_alert)
 
 
 @socketio.on('connect')
 def handle_connect():
-    print(f"=== CLIENT CONNECTED: {request.sid}", flush=True)
+    log.info("=== CLIENT CONNECTED: %s", request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print(f"=== CLIENT DISCONNECTED: {request.sid}", flush=True)
+    log.info("=== CLIENT DISCONNECTED: %s", request.sid)
 
 @socketio.on('join_chat')
 def handle_join_chat(data):
-    print(f"=== JOIN CHAT EVENT RECEIVED: {data}", flush=True)
+    log.debug("=== JOIN CHAT EVENT RECEIVED: %s", data)
     session_id = data.get('session_id')
     user_id = data.get('user_id')
     user_type = data.get('user_type', 'client')  
 
     join_room(session_id)
-    print(f"User {user_id} joined room {session_id}", flush=True)
+    log.info("User %s joined room %s", user_id, session_id)
 
     session = ChatSession.query.filter_by(id=session_id).first()
     if session:
@@ -179,14 +179,14 @@ def handle_leave_chat(data):
 
 @socketio.on('send_message')
 def handle_send_message(data):
-    print(f"=== SEND MESSAGE EVENT RECEIVED: {data}", flush=True)
+    log.debug("=== SEND MESSAGE EVENT RECEIVED: %s", data)
     try:
         session_id = data.get('session_id')
         sender_id = data.get('sender_id')
         content = data.get('content')
         sender_type = data.get('sender_type', 'client')
 
-        print(f"Processing message: session={session_id}, sender={sender_id}, type={sender_type}", flush=True)
+        log.info("Processing message: session=%s, sender=%s, type=%s", session_id, sender_id, sender_type)
 
         message = Message(
             sender_id=sender_id,
@@ -202,7 +202,7 @@ def handle_send_message(data):
             session.last_activity = datetime.now(UTC)
         
         db.session.commit()
-        print(f"Message saved to database: {message.id}", flush=True)
+        log.info("Message saved to database: %s", message.id)
 
         emit('new_message', {
             'id': message.id,
@@ -212,12 +212,10 @@ def handle_send_message(data):
             'message_type': sender_type
         }, room=session_id)
         
-        print(f"Message broadcasted to room {session_id}", flush=True)
+        log.info("Message broadcasted to room %s", session_id)
 
     except Exception as e:
-        print(f"Error handling message: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+        log.exception("Error handling message: %s", e)
         emit('error', {'message': 'Failed to send message'})
 
 @socketio.on('typing_start')
@@ -246,7 +244,7 @@ def handle_mark_read(data):
 
         emit('messages_read', {'message_ids': message_ids})
     except Exception as e:
-        print(f"Error marking messages as read: {e}")
+        log.error("Error marking messages as read: %s", e)
 
 @app.route('/chat/api/sessions', methods=['POST'])
 def create_session():
@@ -390,7 +388,7 @@ def ai_chat():
         })
         
     except Exception as e:
-        print(f"AI Chat Error: {e}", flush=True)
+        log.error("AI Chat Error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 def init_db():
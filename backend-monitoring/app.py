@@ -1,9 +1,11 @@
-from flask import Flask, render_template, request, redirect, jsonify
+from flask import Flask, render_template, request, redirect, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert as upsert
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
 import jwt
 import os
+import time
 from datetime import datetime, timedelta
 import pika
 import requests
@@ -11,16 +13,33 @@ import psycopg2
 import sys
 sys.path.append('/app/shared')
 from rabbitmq_client import RabbitMQ
+import log_utils
+from ingest_probe import IngestProbe
+from device_thresholds import DeviceThresholds
+from mapping_index import MappingIndex
+import rollups
 
 app = Flask(__name__)
 app.config.from_pyfile('config.cfg')
 db = SQLAlchemy(app)
+log = log_utils.get_logger('monitoring-service')
 
-rabbitmq_monitoring_consumer = RabbitMQ('monitoring-service', 'device_crud')  
 pod_name = os.environ.get('HOSTNAME', 'flask-monitoring-0')
 replica_id = int(pod_name.split('-')[-1]) + 1
-rabbitmq_consumption_consumer = RabbitMQ('monitoring-service', 'monitoring_ingest', os.environ.get('COLLECTION_RABBIT_HOST', 'collection-rabbitmq-service.default.svc.cluster.local'), exchange_type='direct', routing_key=f'replica{replica_id}')
+# StatefulSet pod names are stable, so each replica keeps its own durable queues across restarts.
+rabbitmq_monitoring_consumer = RabbitMQ('monitoring-service', 'device_crud', group=pod_name)
+rabbitmq_consumption_consumer = RabbitMQ('monitoring-service', 'monitoring_ingest', os.environ.get('COLLECTION_RABBIT_HOST', 'collection-rabbitmq-service.default.svc.cluster.local'), exchange_type='direct', routing_key=f'replica{replica_id}', group='monitoring-service')
 rabbitmq_alert_producer = RabbitMQ('monitoring-service', 'overconsumption_alerts')  
+monitoring_workers = int(os.environ.get('MONITORING_WORKERS', 4))
+# With a batch size above 1, readings are consumed through consumeBatch and
+# written with one multi-row insert and one commit per batch.
+MONITORING_BATCH_SIZE = int(os.environ.get('MONITORING_BATCH_SIZE', 0))
+MONITORING_BATCH_WAIT_MS = int(os.environ.get('MONITORING_BATCH_WAIT_MS', 200))
+# Rows GET /consumptions fetches from the database cursor at a time while streaming.
+CONSUMPTIONS_FETCH_SIZE = int(os.environ.get('MONITORING_CONSUMPTIONS_FETCH_SIZE', 1000))
+ingest_probe = IngestProbe()
+device_thresholds = DeviceThresholds()
+mapping_index = MappingIndex()
 
 class DeviceConsumption(db.Model):
     __tablename__ = 'deviceConsumption'
@@ -28,6 +47,10 @@ class DeviceConsumption(db.Model):
     mapping_id = db.Column(db.Integer, db.ForeignKey('deviceMapping.mapping_key'), nullable=False)
     consumption = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Serve GET /consumptions: (timestamp, id) walks the keyset order across all
+    # of a user's devices; (mapping_id, timestamp, id) serves a single device's range.
+    __table_args__ = (db.Index('ix_deviceConsumption_timestamp_id', 'timestamp', 'id'),
+                      db.Index('ix_deviceConsumption_mapping_timestamp', 'mapping_id', 'timestamp', 'id'))
     def __repr__(self):
         return f"Consumption: {self.consumption} kWh at {self.timestamp}"
 
@@ -39,9 +62,32 @@ class DeviceMapping(db.Model):
     def __repr__(self):
         return f"Device ID: {self.device_id}, Auth: {self.auth_id}"
 
+# Hourly and daily totals per device and per user, updated in the same
+# transaction as the readings they summarize.
+class DeviceConsumptionRollup(db.Model):
+    __tablename__ = 'deviceConsumptionRollup'
+    bucket = db.Column(db.String(4), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    mapping_id = db.Column(db.Integer, primary_key=True)
+    readings = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    minimum = db.Column(db.Float, nullable=False)
+    maximum = db.Column(db.Float, nullable=False)
+
+class UserConsumptionRollup(db.Model):
+    __tablename__ = 'userConsumptionRollup'
+    bucket = db.Column(db.String(4), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    auth_id = db.Column(db.Integer, primary_key=True)
+    readings = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    minimum = db.Column(db.Float, nullable=False)
+    maximum = db.Column(db.Float, nullable=False)
+
 def handle_device_creation_message(message):
     message_type = message.get('type')
     data = message.get('data', {})
+    device_thresholds.apply(message_type, data)
     
     if message_type == 'add_device':
         with app.app_context():
@@ -49,14 +95,21 @@ def handle_device_creation_message(message):
                 device_id = data.get('device_id')
                 auth_id = data.get('auth_id')
                 
+                existing_mapping = db.session.execute(db.select(DeviceMapping).filter_by(device_id=device_id)).scalar()
+                if existing_mapping:
+                    mapping_index.add(existing_mapping.mapping_key, existing_mapping.device_id, existing_mapping.auth_id)
+                    log.info("Device %s already monitored, skipping duplicate creation", device_id)
+                    return
+
                 device_mapping = DeviceMapping(device_id=device_id, auth_id=auth_id)
                 db.session.add(device_mapping)
                 db.session.commit()
+                mapping_index.add(device_mapping.mapping_key, device_id, auth_id)
                 
-                print(f"Device added to monitoring: {device_id}", flush=True)
+                log.info("Device added to monitoring: %s", device_id)
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to add device to monitoring: {str(e)}", flush=True)
+                log.error("Failed to add device to monitoring: %s", e)
     
     elif message_type == 'delete_device':
         with app.app_context():
@@ -65,23 +118,110 @@ def handle_device_creation_message(message):
                 
                 mapping = db.session.execute(db.select(DeviceMapping).filter_by(device_id=device_id)).scalar()
                 if mapping:
-                    consumption = db.session.execute(db.select(DeviceConsumption).filter_by(mapping_id=mapping.mapping_key)).scalar()
-                    if consumption:
-                        db.session.delete(consumption)
-                    
+                    # All of the device's readings must go before its mapping (foreign key).
+                    db.session.execute(db.delete(DeviceConsumption).filter_by(mapping_id=mapping.mapping_key))
+                    remove_device_rollups(mapping)
                     db.session.delete(mapping)
                 
                 db.session.commit()
-                print(f"Device deleted from monitoring: {device_id}", flush=True)
+                mapping_index.remove(device_id)
+                log.info("Device deleted from monitoring: %s", device_id)
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to delete device from monitoring: {str(e)}", flush=True)
+                log.error("Failed to delete device from monitoring: %s", e)
+
+
+def find_mapping(device_id):
+    # The index is the normal path; a miss (startup warm failed, or another
+    # replica created the mapping) falls back to one query and fills it in.
+    entry = mapping_index.get(device_id)
+    if entry is None:
+        mapping = db.session.execute(db.select(DeviceMapping).filter_by(device_id=device_id)).scalar()
+        if mapping:
+            entry = mapping_index.add(mapping.mapping_key, mapping.device_id, mapping.auth_id)
+    return entry
+
+def warm_mapping_index():
+    with app.app_context():
+        try:
+            rows = db.session.execute(db.select(DeviceMapping.mapping_key, DeviceMapping.device_id, DeviceMapping.auth_id)).all()
+            log.info("Loaded %d device mappings", mapping_index.warm(rows))
+        except Exception as e:
+            db.session.rollback()
+            log.warning("Could not load device mappings, falling back to per-device lookups: %s", e)
+
+
+def update_rollups(readings):
+    # readings: (mapping_key, auth_id, consumption, timestamp). Adds them to
+    # their hour and day buckets; the caller commits.
+    device_rows, user_rows = rollups.aggregate(readings)
+    for model, rows in ((DeviceConsumptionRollup, device_rows), (UserConsumptionRollup, user_rows)):
+        if not rows:
+            continue
+        statement = upsert(model)
+        statement = statement.on_conflict_do_update(
+            index_elements=[column.name for column in model.__table__.primary_key],
+            set_={
+                'readings': model.readings + statement.excluded.readings,
+                'total': model.total + statement.excluded.total,
+                'minimum': db.case((statement.excluded.minimum < model.minimum, statement.excluded.minimum), else_=model.minimum),
+                'maximum': db.case((statement.excluded.maximum > model.maximum, statement.excluded.maximum), else_=model.maximum),
+            }
+        )
+        db.session.execute(statement, rows)
+
+def remove_device_rollups(mapping):
+    # Takes a deleted device's readings and totals back out of its user's
+    # buckets before dropping its own rollups; the caller commits. Minimum and
+    # maximum cannot be un-merged, so a user's buckets keep the deleted
+    # device's extremes until rebuild_rollups.py recomputes those days.
+    device_rows = db.session.execute(
+        db.select(DeviceConsumptionRollup.bucket, DeviceConsumptionRollup.bucket_start, DeviceConsumptionRollup.readings, DeviceConsumptionRollup.total)
+        .filter_by(mapping_id=mapping.mapping_key)
+    ).all()
+    if device_rows:
+        user_rollup = UserConsumptionRollup.__table__
+        db.session.execute(
+            user_rollup.update()
+            .where(user_rollup.c.bucket == db.bindparam('row_bucket'), user_rollup.c.bucket_start == db.bindparam('row_start'), user_rollup.c.auth_id == mapping.auth_id)
+            .values(readings=user_rollup.c.readings - db.bindparam('row_readings'), total=user_rollup.c.total - db.bindparam('row_total')),
+            [{'row_bucket': row.bucket, 'row_start': row.bucket_start, 'row_readings': row.readings, 'row_total': row.total} for row in device_rows]
+        )
+        db.session.execute(db.delete(UserConsumptionRollup).filter_by(auth_id=mapping.auth_id).filter(UserConsumptionRollup.readings <= 0))
+    db.session.execute(db.delete(DeviceConsumptionRollup).filter_by(mapping_id=mapping.mapping_key))
+
+def parse_timestamp(timestamp_str):
+    if timestamp_str:
+        return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+    return datetime.utcnow()
+
+def check_threshold(device_id, auth_id, consumption, timestamp):
+    try:
+        max_consumption = device_thresholds.get(device_id)
+        
+        if max_consumption is not None and float(consumption) > max_consumption:
+            log.warning("OVERCONSUMPTION DETECTED: Device %s, Consumption: %s kWh, Max: %s kWh", device_id, consumption, max_consumption)
+            
+            rabbitmq_alert_producer.sendMessageAsync('overconsumption_alert', {
+                'user_id': str(auth_id),
+                'device_id': device_id,
+                'consumption': float(consumption),
+                'threshold': max_consumption,
+                'timestamp': timestamp.isoformat()
+            })
+            log.info("Overconsumption alert sent for device %s", device_id)
+    except Exception as e:
+        log.error("Error checking threshold or sending alert: %s", e)
 
 
 def handle_consumption_message(message):
     message_type = message.get('type')
     data = message.get('data', {})
     
+    if message_type == 'consumption_batch':
+        handle_consumption_batch(data.get('readings', []))
+        return
+
     if message_type == 'consumption_reading':
         with app.app_context():
             try:
@@ -90,38 +230,10 @@ def handle_consumption_message(message):
                 consumption = data.get('consumption')
                 timestamp_str = data.get('timestamp')
                 
-                mapping = db.session.execute(db.select(DeviceMapping).filter_by(device_id=device_id)).scalar()
+                mapping = find_mapping(device_id)
                 if mapping:
-                    if timestamp_str:
-                        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                    else:
-                        timestamp = datetime.utcnow()
-                    
-                    try:
-                        device_response = requests.get(
-                            f"http://flask-device-service.default.svc.cluster.local/devices",
-                            timeout=5
-                        )
-                        if device_response.status_code == 200:
-                            devices = device_response.json().get('devices', [])
-                            device_info = next((d for d in devices if d['device_id'] == device_id), None)
-                            
-                            if device_info:
-                                max_consumption = float(device_info.get('maxConsumption', 0))
-                                
-                                if float(consumption) > max_consumption:
-                                    print(f"⚠️  OVERCONSUMPTION DETECTED: Device {device_id}, Consumption: {consumption} kWh, Max: {max_consumption} kWh", flush=True)
-                                    
-                                    rabbitmq_alert_producer.sendMessage('overconsumption_alert', {
-                                        'user_id': str(auth_id),
-                                        'device_id': device_id,
-                                        'consumption': float(consumption),
-                                        'threshold': max_consumption,
-                                        'timestamp': timestamp.isoformat()
-                                    })
-                                    print(f"Overconsumption alert sent for device {device_id}", flush=True)
-                    except Exception as e:
-                        print(f"Error fetching device info or sending alert: {str(e)}", flush=True)
+                    timestamp = parse_timestamp(timestamp_str)
+                    check_threshold(device_id, auth_id, consumption, timestamp)
                     
                     device_consumption = DeviceConsumption(
                         mapping_id=mapping.mapping_key,
@@ -129,31 +241,170 @@ def handle_consumption_message(message):
                         timestamp=timestamp
                     )
                     db.session.add(device_consumption)
+                    update_rollups([(mapping.mapping_key, mapping.auth_id, float(consumption), timestamp)])
                     db.session.commit()
+                    ingest_probe.record(data)
                     
-                    print(f"Stored consumption for device {device_id}: {consumption} kWh at {timestamp}", flush=True)
+                    log.info("Stored consumption for device %s: %s kWh at %s", device_id, consumption, timestamp, extra=log_utils.SAMPLED)
                 else:
-                    print(f"No mapping found for device {device_id}", flush=True)
+                    log.warning("No mapping found for device %s", device_id)
                     
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to store consumption data: {str(e)}", flush=True)
+                log.error("Failed to store consumption data: %s", e)
 
 
+def store_readings(readings):
+    # Stores readings with one multi-row insert and one commit, rollups
+    # included. A failed commit is rolled back and re-raised so the caller's
+    # deliveries go through retry instead of being acked. Readings that can
+    # never be stored (unknown device, malformed data) are dropped, as in the
+    # per-reading path.
+    with app.app_context():
+        rows = []
+        totals = []
+        stored = []
+        for data in readings:
+            try:
+                device_id = data.get('device_id')
+                mapping = find_mapping(device_id)
+                if not mapping:
+                    log.warning("No mapping found for device %s", device_id, extra=log_utils.SAMPLED)
+                    continue
+                consumption = float(data.get('consumption'))
+                timestamp = parse_timestamp(data.get('timestamp'))
+                rows.append({'mapping_id': mapping.mapping_key, 'consumption': consumption, 'timestamp': timestamp})
+                totals.append((mapping.mapping_key, mapping.auth_id, consumption, timestamp))
+                stored.append(data)
+            except Exception as e:
+                log.error("Dropping invalid consumption reading %s: %s", data, e)
+
+        if rows:
+            try:
+                db.session.execute(db.insert(DeviceConsumption), rows)
+                update_rollups(totals)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                log.error("Failed to store batch of %d readings: %s", len(rows), e)
+                raise
+
+    committed_at = time.time()
+    for data, row in zip(stored, rows):
+        check_threshold(data.get('device_id'), data.get('auth_id'), row['consumption'], row['timestamp'])
+        ingest_probe.record(data, committed_at)
+    return len(rows)
+
+
+def handle_consumption_batch(readings):
+    # A load balancer envelope is stored in one transaction; an error propagates
+    # so the whole envelope is retried rather than acked with readings missing.
+    stored = store_readings(readings)
+    log.info("Stored %d of %d readings from envelope", stored, len(readings), extra=log_utils.SAMPLED)
+
+
+def handle_consumption_deliveries(messages):
+    # Write-behind path for consumeBatch: the readings of every delivery in the
+    # batch (single readings and load balancer envelopes alike) are stored
+    # together. consumeBatch acks the deliveries only after this returns, and a
+    # failed commit hands all of them back for retry, so nothing is acked
+    # before it is stored.
+    readings = []
+    for message in messages:
+        if message.get('type') == 'consumption_batch':
+            readings.extend(message.get('data', {}).get('readings', []))
+        elif message.get('type') == 'consumption_reading':
+            readings.append(message.get('data', {}))
+
+    try:
+        stored = store_readings(readings)
+    except Exception:
+        return list(range(len(messages)))
+    log.info("Stored %d of %d readings from %d deliveries", stored, len(readings), len(messages), extra=log_utils.SAMPLED)
+    return []
+
+
+device_thresholds.start()
+warm_mapping_index()
 rabbitmq_monitoring_consumer.consumeMessage(handle_device_creation_message)
-rabbitmq_consumption_consumer.consumeMessage(handle_consumption_message)
+if MONITORING_BATCH_SIZE > 1:
+    rabbitmq_consumption_consumer.consumeBatch(handle_consumption_deliveries, MONITORING_BATCH_SIZE, MONITORING_BATCH_WAIT_MS)
+else:
+    rabbitmq_consumption_consumer.consumeMessage(handle_consumption_message, workers=monitoring_workers, ordering_key='device_id')
+
+@app.route('/device-thresholds', methods=["GET"])
+def get_device_thresholds():
+    return jsonify(device_thresholds.metrics())
+
+@app.route('/ingest-probe', methods=["GET"])
+def get_ingest_probe():
+    return jsonify(ingest_probe.snapshot())
+
+@app.route('/ingest-probe', methods=["DELETE"])
+def reset_ingest_probe():
+    ingest_probe.reset()
+    return jsonify({'ok': 'Ingest probe reset'})
+
+@app.route('/consumptions/series', methods=["GET"])
+def get_consumption_series():
+    # Bucketed series straight from the rollup tables, for a user or a device.
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in rollups.BUCKETS:
+        return jsonify({"error": "bucket must be 'hour' or 'day'"}), 400
+    try:
+        start, end = rollups.parse_range(bucket, request.args.get('from'), request.args.get('to'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid range: {e}"}), 400
+
+    user_id = request.args.get('user_id')
+    device_id = request.args.get('device_id')
+    try:
+        device_id = int(device_id) if device_id else None
+        user_id = int(user_id) if user_id else None
+    except ValueError:
+        return jsonify({"error": "user_id and device_id must be integers"}), 400
+    if device_id is not None:
+        mapping = find_mapping(device_id)
+        if not mapping:
+            return jsonify({"error": "Device is not monitored"}), 404
+        model, filters = DeviceConsumptionRollup, {'mapping_id': mapping.mapping_key}
+    elif user_id is not None:
+        model, filters = UserConsumptionRollup, {'auth_id': user_id}
+    else:
+        return jsonify({"error": "user_id or device_id is required"}), 400
+
+    rows = db.session.execute(
+        db.select(model.bucket_start, model.readings, model.total, model.minimum, model.maximum)
+        .filter_by(bucket=bucket, **filters)
+        .filter(model.bucket_start >= start, model.bucket_start < end)
+        .order_by(model.bucket_start)
+    ).all()
+    series = [{
+        "start": row.bucket_start.isoformat(),
+        "readings": row.readings,
+        "total": round(row.total, 3),
+        "average": round(row.total / row.readings, 3),
+        "min": row.minimum,
+        "max": row.maximum
+    } for row in rows]
+    return jsonify({"bucket": bucket, "from": start.isoformat(), "to": end.isoformat(), "series": series}), 200
 
 @app.route('/consumptions', methods=["GET"])
 def get_consumptions():
+    # One joined query ordered by (timestamp, id), read through a server-side
+    # cursor and streamed out row by row. With limit, the response carries a
+    # next_cursor for the following page (keyset pagination).
     user_id = request.args.get('user_id')
     date_str = request.args.get('date')
     
-    query = DeviceConsumption.query
+    query = (db.select(DeviceConsumption.id, DeviceConsumption.consumption, DeviceConsumption.timestamp, DeviceMapping.device_id, DeviceMapping.auth_id)
+             .join(DeviceMapping, DeviceMapping.mapping_key == DeviceConsumption.mapping_id))
     
     if user_id:
-        user_id_int = int(user_id)
-        mapping_subquery = db.select(DeviceMapping.mapping_key).filter_by(auth_id=user_id_int)
-        query = query.filter(DeviceConsumption.mapping_id.in_(mapping_subquery))
+        try:
+            query = query.filter(DeviceMapping.auth_id == int(user_id))
+        except ValueError:
+            return jsonify({"error": "user_id must be an integer"}), 400
     
     if date_str:
         try:
@@ -164,22 +415,52 @@ def get_consumptions():
         except ValueError:
             return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
     
-    consumptions = query.all()
-    if not consumptions:
-        return jsonify({"consumptions": []}), 200
+    try:
+        if request.args.get('from'):
+            query = query.filter(DeviceConsumption.timestamp >= rollups.parse_time(request.args['from']))
+        if request.args.get('to'):
+            query = query.filter(DeviceConsumption.timestamp < rollups.parse_time(request.args['to']))
+        if request.args.get('cursor'):
+            cursor_timestamp, _, cursor_id = request.args['cursor'].rpartition(',')
+            query = query.filter(db.tuple_(DeviceConsumption.timestamp, DeviceConsumption.id) > (datetime.fromisoformat(cursor_timestamp), int(cursor_id)))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid range, cursor or limit: {e}"}), 400
     
-    consumption_list = []
-    for consumption in consumptions:
-        mapping = db.session.execute(db.select(DeviceMapping).filter_by(mapping_key=consumption.mapping_id)).scalar()
-        if mapping:
-            consumption_list.append({
-                "device_id": mapping.device_id,
-                "auth_id": mapping.auth_id,
-                "consumption": str(consumption.consumption),
-                "timestamp": consumption.timestamp.isoformat()
+    query = query.order_by(DeviceConsumption.timestamp, DeviceConsumption.id)
+    if limit:
+        query = query.limit(limit)
+    ndjson = request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    
+    def generate():
+        # JSON keeps the {"consumptions": [...]} shape; NDJSON writes one reading
+        # per line, followed by a {"next_cursor": ...} line when there are more pages.
+        if not ndjson:
+            yield '{"consumptions": ['
+        count = 0
+        last = None
+        for row in db.session.execute(query.execution_options(yield_per=CONSUMPTIONS_FETCH_SIZE)):
+            consumption = json.dumps({
+                "device_id": row.device_id,
+                "auth_id": row.auth_id,
+                "consumption": str(row.consumption),
+                "timestamp": row.timestamp.isoformat()
             })
+            if ndjson:
+                yield consumption + '\n'
+            else:
+                yield (',' if count else '') + consumption
+            count += 1
+            last = row
+        next_cursor = f"{last.timestamp.isoformat()},{last.id}" if limit and count == limit else None
+        if not ndjson:
+            yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+        elif next_cursor:
+            yield json.dumps({"next_cursor": next_cursor}) + '\n'
     
-    return jsonify({"consumptions": consumption_list}), 200
+    return app.response_class(stream_with_context(generate()), status=200, mimetype='application/x-ndjson' if ndjson else 'application/json')
 
 if __name__ == '__main__':
       with app.app_context(): 
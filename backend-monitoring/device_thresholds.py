@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+import requests
+import log_utils
+
+DEVICES_URL = os.environ.get('DEVICE_SERVICE_URL', 'http://flask-device-service.default.svc.cluster.local') + '/devices'
+# Until one bootstrap from the device service succeeds, a cache miss retries it at most this often.
+BOOTSTRAP_RETRY_INTERVAL = float(os.environ.get('MONITORING_THRESHOLD_RETRY', 30))
+
+log = log_utils.get_logger('monitoring-service.thresholds')
+
+class DeviceThresholds():
+    # device_id -> maxConsumption, loaded once from the device service and then
+    # kept current by add_device/update_device/delete_device events, so the
+    # reading path never calls the device service.
+    def __init__(self, url=DEVICES_URL, retry_interval=BOOTSTRAP_RETRY_INTERVAL):
+        self.url = url
+        self.retry_interval = retry_interval
+        self.lock = threading.Lock()
+        self.thresholds = {}
+        self.bootstrapped = False
+        self.bootstrapping = False
+        self.next_attempt = 0
+        # Devices changed by events while a bootstrap is in flight; the
+        # response may predate those changes, so it must not overwrite them.
+        self.touched = None
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+        self.bootstraps = 0
+
+    def bootstrap(self):
+        with self.lock:
+            if self.bootstrapping:
+                return False
+            self.bootstrapping = True
+            self.touched = set()
+            self.next_attempt = time.monotonic() + self.retry_interval
+        devices = None
+        try:
+            response = requests.get(self.url, timeout=5)
+            if response.status_code == 200:
+                devices = response.json().get('devices', [])
+            else:
+                log.warning("Failed to fetch device thresholds: %s", response.status_code)
+        except Exception as e:
+            log.error("Error fetching device thresholds: %s", e)
+        with self.lock:
+            if devices is not None:
+                for device in devices:
+                    if device['device_id'] not in self.touched:
+                        self.thresholds[device['device_id']] = float(device.get('maxConsumption', 0))
+                self.bootstrapped = True
+                self.bootstraps += 1
+            self.touched = None
+            self.bootstrapping = False
+        if devices is not None:
+            log.info("Loaded thresholds for %d devices", len(devices))
+        return devices is not None
+
+    def start(self):
+        threading.Thread(target=self.bootstrap, daemon=True).start()
+        return self
+
+    def get(self, device_id):
+        threshold = self.thresholds.get(device_id)
+        with self.lock:
+            if threshold is not None:
+                self.hits += 1
+                return threshold
+            self.misses += 1
+            retry = not self.bootstrapped and time.monotonic() >= self.next_attempt
+        if retry and self.bootstrap():
+            return self.thresholds.get(device_id)
+        return None
+
+    def apply(self, message_type, data):
+        device_id = data.get('device_id')
+        with self.lock:
+            if message_type in ('add_device', 'update_device') and data.get('maxConsumption') is not None:
+                self.thresholds[device_id] = float(data['maxConsumption'])
+            elif message_type == 'delete_device':
+                self.thresholds.pop(device_id, None)
+            else:
+                return
+            self.events += 1
+            if self.touched is not None:
+                self.touched.add(device_id)
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'devices': len(self.thresholds),
+                'bootstrapped': self.bootstrapped,
+                'bootstraps': self.bootstraps,
+                'events': self.events,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,93 @@
+import math
+import time
+import threading
+import collections
+
+# Latencies go into log-spaced buckets (~5% wide), so snapshots from several
+# replicas can be merged by adding counts and still give usable percentiles.
+BUCKET_BASE = 1.05
+
+def bucket_upper_ms(bucket):
+    return BUCKET_BASE ** (bucket + 1)
+
+def percentile(histogram, fraction, limit=None):
+    # Upper edge of the bucket holding the percentile, capped at the observed maximum.
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= total * fraction:
+            upper = bucket_upper_ms(bucket)
+            return round(upper if limit is None else min(upper, limit), 2)
+
+class IngestProbe():
+    # Measures sent_at -> commit latency and per-device sequence gaps for
+    # readings produced by the simulator load generator. Readings without
+    # sent_at (the normal simulator) are ignored.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.histogram = collections.Counter()
+        self.received = 0
+        self.gaps = 0
+        self.out_of_order = 0
+        self.max_latency_ms = 0.0
+        self.first_at = None
+        self.last_at = None
+        self.device_seqs = {}
+
+    def reset(self):
+        with self.lock:
+            self.clear()
+
+    def record(self, data, committed_at=None):
+        sent_at = data.get('sent_at')
+        if sent_at is None:
+            return
+        committed_at = committed_at or time.time()
+        latency_ms = max((committed_at - sent_at) * 1000, 0.001)
+        with self.lock:
+            self.histogram[int(math.floor(math.log(latency_ms, BUCKET_BASE)))] += 1
+            self.received += 1
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+            self.first_at = committed_at if self.first_at is None else min(self.first_at, committed_at)
+            self.last_at = committed_at if self.last_at is None else max(self.last_at, committed_at)
+
+            # device_seq only increases per device, and a device sticks to one
+            # replica under hash routing, so a jump means readings were lost
+            # upstream and a step back means one arrived late or twice.
+            seq = data.get('device_seq')
+            if seq is None:
+                return
+            key = (data.get('run_id'), data.get('device_id'))
+            last = self.device_seqs.get(key)
+            if last is not None:
+                if seq > last + 1:
+                    self.gaps += seq - last - 1
+                elif seq <= last:
+                    self.out_of_order += 1
+            if last is None or seq > last:
+                self.device_seqs[key] = seq
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = (self.last_at - self.first_at) if self.received > 1 else 0
+            return {
+                'received': self.received,
+                'throughput': round(self.received / elapsed, 1) if elapsed else None,
+                'gaps': self.gaps,
+                'out_of_order': self.out_of_order,
+                'latency_ms': {
+                    'p50': percentile(self.histogram, 0.5, self.max_latency_ms),
+                    'p90': percentile(self.histogram, 0.9, self.max_latency_ms),
+                    'p99': percentile(self.histogram, 0.99, self.max_latency_ms),
+                    'max': round(self.max_latency_ms, 2),
+                },
+                'first_at': self.first_at,
+                'last_at': self.last_at,
+                'histogram': {str(bucket): count for bucket, count in sorted(self.histogram.items())},
+            }
@@ -0,0 +1,40 @@
+import threading
+import collections
+
+MappingEntry = collections.namedtuple('MappingEntry', ['mapping_key', 'device_id', 'auth_id'])
+
+class MappingIndex():
+    # In-memory copy of deviceMapping, indexed by device_id.
+    # Warmed from the table at startup and updated from add_device and
+    # delete_device, so storing a reading needs no lookup query.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_device = {}
+
+    def warm(self, rows):
+        with self.lock:
+            for mapping_key, device_id, auth_id in rows:
+                self._add(MappingEntry(mapping_key, device_id, auth_id))
+        return len(self.by_device)
+
+    def _add(self, entry):
+        self.by_device[entry.device_id] = entry
+
+    def _remove(self, device_id):
+        self.by_device.pop(device_id, None)
+
+    def add(self, mapping_key, device_id, auth_id):
+        entry = MappingEntry(mapping_key, device_id, auth_id)
+        with self.lock:
+            self._add(entry)
+        return entry
+
+    def remove(self, device_id):
+        with self.lock:
+            self._remove(device_id)
+
+    def get(self, device_id):
+        return self.by_device.get(device_id)
+
+    def __len__(self):
+        return len(self.by_device)
@@ -0,0 +1,58 @@
+# Recomputes the hourly and daily rollups for whole UTC days from the raw
+# readings, e.g. to backfill days recorded before the rollup tables existed:
+#
+#   python rebuild_rollups.py --from 2025-11-01 --to 2025-12-01
+#
+# Rollup rows in the range are replaced one day per transaction. Readings
+# ingested for a day while it is being rebuilt can be lost from its rollups,
+# so only rebuild days that no longer receive readings.
+import argparse
+import os
+import sqlalchemy
+from datetime import datetime, timedelta
+import rollups
+
+TABLES = ('deviceConsumption', 'deviceMapping', 'deviceConsumptionRollup', 'userConsumptionRollup')
+
+def database_uri():
+    config = {}
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.cfg')) as config_file:
+        exec(config_file.read(), config)
+    return config['SQLALCHEMY_DATABASE_URI']
+
+def rebuild_day(connection, tables, day):
+    consumption, mapping, device_rollup, user_rollup = tables
+    end = day + timedelta(days=1)
+    readings = connection.execute(
+        sqlalchemy.select(consumption.c.mapping_id, mapping.c.auth_id, consumption.c.consumption, consumption.c.timestamp)
+        .join(mapping, mapping.c.mapping_key == consumption.c.mapping_id)
+        .where(consumption.c.timestamp >= day, consumption.c.timestamp < end)
+        .execution_options(yield_per=10000)
+    )
+    device_rows, user_rows = rollups.aggregate(tuple(reading) for reading in readings)
+    for table, rows in ((device_rollup, device_rows), (user_rollup, user_rows)):
+        connection.execute(table.delete().where(table.c.bucket_start >= day, table.c.bucket_start < end))
+        if rows:
+            connection.execute(table.insert(), rows)
+    return sum(row['readings'] for row in device_rows if row['bucket'] == 'day')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--from', dest='start', required=True, help="first UTC day to rebuild (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', required=True, help="day after the last one to rebuild (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    day = datetime.strptime(args.start, '%Y-%m-%d')
+    end = datetime.strptime(args.end, '%Y-%m-%d')
+    engine = sqlalchemy.create_engine(database_uri())
+    metadata = sqlalchemy.MetaData()
+    metadata.reflect(engine, only=TABLES)
+    tables = [metadata.tables[name] for name in TABLES]
+    while day < end:
+        with engine.begin() as connection:
+            readings = rebuild_day(connection, tables, day)
+        print(f"{day.date()}: {readings} readings")
+        day += timedelta(days=1)
+
+if __name__ == '__main__':
+    main()
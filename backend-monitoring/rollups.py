@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+BUCKETS = ('hour', 'day')
+
+def utc_naive(timestamp):
+    # Readings are stored as naive UTC; readings sent with an offset are converted first.
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def bucket_start(timestamp, bucket):
+    timestamp = utc_naive(timestamp)
+    if bucket == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def aggregate(readings):
+    # readings: (mapping_key, auth_id, consumption, timestamp) tuples.
+    # Returns the per-device and per-user rollup increments for every bucket
+    # size, sorted by key so concurrent writers lock rollup rows in one order.
+    devices = {}
+    users = {}
+    for mapping_key, auth_id, consumption, timestamp in readings:
+        for bucket in BUCKETS:
+            start = bucket_start(timestamp, bucket)
+            for totals, key in ((devices, (bucket, start, mapping_key)), (users, (bucket, start, auth_id))):
+                current = totals.get(key)
+                if current is None:
+                    totals[key] = [1, consumption, consumption, consumption]
+                else:
+                    current[0] += 1
+                    current[1] += consumption
+                    current[2] = min(current[2], consumption)
+                    current[3] = max(current[3], consumption)
+
+    def rows(totals, key_name):
+        return [{'bucket': bucket, 'bucket_start': start, key_name: key, 'readings': count, 'total': total, 'minimum': minimum, 'maximum': maximum}
+                for (bucket, start, key), (count, total, minimum, maximum) in sorted(totals.items())]
+    return rows(devices, 'mapping_id'), rows(users, 'auth_id')
+
+def parse_time(value):
+    return utc_naive(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+def parse_range(bucket, from_str=None, to_str=None):
+    # from is inclusive and to exclusive; both accept a date or an ISO datetime.
+    # Without from, hourly series cover the last day and daily ones the last 30.
+    end = parse_time(to_str) if to_str else datetime.utcnow()
+    start = parse_time(from_str) if from_str else end - timedelta(days=1 if bucket == 'hour' else 30)
+    if start >= end:
+        raise ValueError("'from' must be before 'to'")
+    return bucket_start(start, bucket), end
@@ -11,14 +11,16 @@ import psycopg2
 import sys
 sys.path.append('/app/shared')
 from rabbitmq_client import RabbitMQ
+import log_utils
 
 app = Flask(__name__)
 app.config.from_pyfile('config.cfg')
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'fallback-secret-for-development-only')
 
 db = SQLAlchemy(app)
+log = log_utils.get_logger('user-service')
 
-rabbitmq_consumer = RabbitMQ('user-service', 'user_events') 
+rabbitmq_consumer = RabbitMQ('user-service', 'user_events', group='user-service')
 rabbitmq_publisher = RabbitMQ('user-service', 'user_crud_events')  
 
 
@@ -50,7 +52,7 @@ def handle_message(message):
             
                 existing_user_auth = db.session.execute(db.select(UserAuth).filter_by(auth_id=auth_id)).scalar()
                 if existing_user_auth:
-                    print(f"User with auth_id {auth_id} already exists, skipping duplicate creation", flush=True)
+                    log.info("User with auth_id %s already exists, skipping duplicate creation", auth_id)
                     return
                 
                 user_record = User(username=username, email=email, role=role)
@@ -61,10 +63,10 @@ def handle_message(message):
                 db.session.add(user_auth)
                 db.session.commit()
                 
-                print(f"User created successfully via message: {username}", flush=True)
+                log.info("User created successfully via message: %s", username)
             except Exception as e:
                 db.session.rollback()
-                print(f"Failed to create user via message: {str(e)}", flush=True)
+                log.error("Failed to create user via message: %s", e)
 
 rabbitmq_consumer.consumeMessage(handle_message)
 
@@ -221,10 +223,10 @@ def edit_user():
         db.session.commit()
         
         auth_payload = {"auth_id": auth_id, "username": username, "email": email}
-        rabbitmq_publisher.sendMessage('update_auth_profile', auth_payload)
+        rabbitmq_publisher.sendMessageAsync('update_auth_profile', auth_payload)
         
         device_payload = {"auth_id": auth_id, "username": username, "email": email, "role": role}
-        rabbitmq_publisher.sendMessage('update_user_in_devices', device_payload)
+        rabbitmq_publisher.sendMessageAsync('update_user_in_devices', device_payload)
         
         response = {'ok': 'User edited successfully'}
         return app.response_class(
@@ -300,10 +302,10 @@ def delete_user():
             )
 
         auth_payload = {"auth_id": auth_id}
-        rabbitmq_publisher.sendMessage('delete_auth', auth_payload)
+        rabbitmq_publisher.sendMessageAsync('delete_auth', auth_payload)
         
         device_payload = {"auth_id": auth_id}
-        rabbitmq_publisher.sendMessage('delete_device_user', device_payload)
+        rabbitmq_publisher.sendMessageAsync('delete_device_user', device_payload)
         
         db.session.delete(user_auth)
         db.session.flush() 
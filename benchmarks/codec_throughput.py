@@ -0,0 +1,53 @@
+# Encode/decode cost per consumption reading for each message codec.
+#
+#   python benchmarks/codec_throughput.py --readings 50000
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+import message_codecs
+
+def make_readings(count):
+    now = datetime.utcnow().isoformat()
+    return [{
+        "type": "consumption_reading",
+        "data": {
+            'device_id': random.randint(1, 100000),
+            'auth_id': random.randint(1, 10000),
+            'consumption': round(random.uniform(0.1, 150), 3),
+            'timestamp': now
+        },
+        "sender": "simulator-service"
+    } for _ in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readings', type=int, default=20000)
+    args = parser.parse_args()
+
+    readings = make_readings(args.readings)
+    print(f"{'codec':<10}{'encode us':>12}{'decode us':>12}{'bytes':>8}")
+    for name in ('json', 'orjson', 'msgpack'):
+        try:
+            codec = message_codecs.get_codec(name)
+        except RuntimeError as e:
+            print(f"{name:<10} skipped: {e}")
+            continue
+
+        start = time.perf_counter()
+        bodies = [codec.encode(reading) for reading in readings]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for body in bodies:
+            message_codecs.decode(body, codec.content_type)
+        decode_time = time.perf_counter() - start
+
+        size = sum(len(body) for body in bodies) / len(bodies)
+        print(f"{name:<10}{encode_time / len(readings) * 1e6:>12.2f}{decode_time / len(readings) * 1e6:>12.2f}{size:>8.0f}")
+
+if __name__ == '__main__':
+    main()
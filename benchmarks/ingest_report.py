@@ -0,0 +1,64 @@
+# Merges the ingest probes of every monitoring replica (and optionally the
+# simulator load generator's stats) into one pipeline report.
+#
+#   SIMULATOR_LOAD_PROFILE=ramp:100:5000:300 python app.py     # in device-simulator
+#   python benchmarks/ingest_report.py --reset http://flask-monitoring-{0,1,2}.flask-monitoring:5001
+#   python benchmarks/ingest_report.py --simulator http://device-simulator-service \
+#       http://flask-monitoring-0.flask-monitoring:5001 http://flask-monitoring-1.flask-monitoring:5001
+import argparse
+import collections
+import json
+import os
+import sys
+import urllib.request
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'backend-monitoring'))
+from ingest_probe import percentile
+
+def fetch(url, method='GET'):
+    with urllib.request.urlopen(urllib.request.Request(url, method=method), timeout=10) as response:
+        return json.loads(response.read())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('replicas', nargs='+', help="base URLs of the monitoring replicas")
+    parser.add_argument('--simulator', help="base URL of the simulator running a load profile")
+    parser.add_argument('--reset', action='store_true', help="clear every replica's probe before a run")
+    args = parser.parse_args()
+
+    if args.reset:
+        for replica in args.replicas:
+            fetch(f"{replica.rstrip('/')}/ingest-probe", method='DELETE')
+        print(f"Reset {len(args.replicas)} ingest probe(s)")
+        return
+
+    histogram = collections.Counter()
+    received = gaps = out_of_order = 0
+    first_at, last_at, max_latency = None, None, 0.0
+    for replica in args.replicas:
+        probe = fetch(f"{replica.rstrip('/')}/ingest-probe")
+        print(f"{replica}: {probe['received']} readings, p99 {probe['latency_ms']['p99']} ms, {probe['gaps']} gaps")
+        histogram.update({int(bucket): count for bucket, count in probe['histogram'].items()})
+        received += probe['received']
+        gaps += probe['gaps']
+        out_of_order += probe['out_of_order']
+        max_latency = max(max_latency, probe['latency_ms']['max'])
+        if probe['first_at'] is not None:
+            first_at = probe['first_at'] if first_at is None else min(first_at, probe['first_at'])
+            last_at = probe['last_at'] if last_at is None else max(last_at, probe['last_at'])
+
+    if args.simulator:
+        stats = fetch(f"{args.simulator.rstrip('/')}/stats")
+        print(f"simulator:          {stats.get('profile')} sent {stats.get('sent')} at {stats.get('achieved_rate')} msg/s, {stats.get('behind_schedule')} behind schedule")
+    elapsed = (last_at - first_at) if received > 1 else 0
+    print(f"committed:          {received}")
+    print(f"sustained rate:     {received / elapsed if elapsed else 0:10.1f} msg/s")
+    print(f"latency p50:        {percentile(histogram, 0.5, max_latency)} ms")
+    print(f"latency p90:        {percentile(histogram, 0.9, max_latency)} ms")
+    print(f"latency p99:        {percentile(histogram, 0.99, max_latency)} ms")
+    print(f"latency max:        {max_latency:.2f} ms")
+    print(f"sequence gaps:      {gaps}")
+    print(f"out of order:       {out_of_order}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Drives synthetic consumption readings through load-balancer/app.py and
+# reports forwarding throughput, latency and how evenly readings and devices
+# were spread over the replica{N} queues.
+#
+#   python benchmarks/lb_throughput.py --readings 20000
+#   python benchmarks/lb_throughput.py --rate 2000 --readings 20000
+#   LB_ROUTING=round-robin LB_BATCH_SIZE=100 python benchmarks/lb_throughput.py
+#   python benchmarks/lb_throughput.py --broker amqp --host localhost
+#
+# With --broker memory (the default) everything runs in this process on the
+# in-memory broker. With amqp (or memory://host:port) the load balancer and
+# replica consumers connect to --host. Pass --external-lb to measure a load
+# balancer that is already running against that broker instead of starting one.
+import argparse
+import importlib.util
+import os
+import queue
+import sys
+import threading
+import time
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'shared'))
+sys.path.append(os.path.join(ROOT, 'load-balancer'))
+
+def quiet():
+    sys.stdout = open(os.devnull, 'w')
+
+def start_load_balancer():
+    spec = importlib.util.spec_from_file_location('load_balancer_app', os.path.join(ROOT, 'load-balancer', 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    threading.Thread(target=module.main, daemon=True).start()
+
+def start_replica(replica_id, host, results):
+    from rabbitmq_client import RabbitMQ
+
+    def handle(message):
+        now = time.time()
+        readings = message['data']['readings'] if message['type'] == 'consumption_batch' else [message['data']]
+        for data in readings:
+            results.put((replica_id, data['device_id'], now - data['sent_at']))
+
+    consumer = RabbitMQ('monitoring-service', 'monitoring_ingest', host, exchange_type='direct',
+                        routing_key=f'replica{replica_id}', group='monitoring-service')
+    threading.Thread(target=consumer.consumeMessage, args=(handle,), daemon=True).start()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=0, help="readings/s offered to the load balancer, 0 = as fast as possible")
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--broker', default='memory', help="memory, amqp or memory://host:port")
+    parser.add_argument('--host', default='collection-rabbitmq-service.default.svc.cluster.local')
+    parser.add_argument('--external-lb', action='store_true', help="measure an already running load balancer")
+    args = parser.parse_args()
+
+    os.environ['RABBIT_BROKER'] = args.broker
+    os.environ['RABBIT_HOST'] = args.host
+    os.environ['MONITORING_REPLICAS'] = str(args.replicas)
+    os.environ.setdefault('LB_MEMBERSHIP_INTERVAL', '0.2')
+    out = sys.stdout
+    quiet()
+
+    results = queue.Queue()
+    for replica_id in range(1, args.replicas + 1):
+        start_replica(replica_id, args.host, results)
+    time.sleep(0.5)
+    if not args.external_lb:
+        start_load_balancer()
+    time.sleep(1)
+
+    from rabbitmq_client import RabbitMQ
+    producer = RabbitMQ('simulator-service', 'consumption_data', args.host)
+    start = time.time()
+    for index in range(args.readings):
+        if args.rate:
+            # Open loop: each reading has a fixed send time, independent of how long earlier sends took.
+            delay = start + index / args.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        producer.sendMessage('consumption_reading', {'device_id': index % args.devices, 'auth_id': 1, 'consumption': 1.0, 'sent_at': time.time()})
+    publish_elapsed = time.time() - start
+
+    latencies = []
+    per_replica = {replica_id: 0 for replica_id in range(1, args.replicas + 1)}
+    device_replicas = {}
+    while len(latencies) < args.readings:
+        try:
+            replica_id, device_id, latency = results.get(timeout=30)
+        except queue.Empty:
+            break
+        latencies.append(latency)
+        per_replica[replica_id] += 1
+        device_replicas.setdefault(device_id, set()).add(replica_id)
+    elapsed = time.time() - start
+
+    sys.stdout = out
+    mean = len(latencies) / args.replicas
+    print(f"routing:            {os.environ.get('LB_ROUTING', 'hash')}, batch size {os.environ.get('LB_BATCH_SIZE', '0')}")
+    print(f"readings:           {len(latencies)}/{args.readings} forwarded")
+    print(f"offered rate:       {args.readings / publish_elapsed:10.1f} msg/s")
+    print(f"forwarded rate:     {len(latencies) / elapsed:10.1f} msg/s")
+    if latencies:
+        print(f"latency p50:        {percentile(latencies, 0.5) * 1000:10.2f} ms")
+        print(f"latency p99:        {percentile(latencies, 0.99) * 1000:10.2f} ms")
+        print(f"per replica:        {per_replica}")
+        print(f"skew (max/mean):    {max(per_replica.values()) / mean:10.2f}")
+        print(f"devices split:      {sum(1 for replicas in device_replicas.values() if len(replicas) > 1)}/{len(device_replicas)} seen on more than one replica")
+
+if __name__ == '__main__':
+    main()
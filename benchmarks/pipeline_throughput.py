@@ -0,0 +1,135 @@
+# Runs the simulator -> load balancer -> monitoring -> messages pipeline on the
+# in-memory broker and reports end-to-end throughput and latency.
+#
+#   python benchmarks/pipeline_throughput.py --readings 5000
+#   python benchmarks/pipeline_throughput.py --readings 5000 --subprocess
+#   LB_BATCH_SIZE=100 python benchmarks/pipeline_throughput.py --readings 5000
+#
+# The load balancer is the real load-balancer/app.py; monitoring replicas and
+# the messages service are stand-ins that only time deliveries and forward
+# overconsumption alerts, so no database or device service is needed.
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'shared'))
+
+# Replicas start alongside the load balancer; probe often so none is left out.
+os.environ.setdefault('LB_MEMBERSHIP_INTERVAL', '0.2')
+
+COLLECTION_HOST = 'collection-rabbitmq-service.default.svc.cluster.local'
+REPLICAS = 3
+THRESHOLD = 100.0
+
+def quiet():
+    sys.stdout = open(os.devnull, 'w')
+
+def run_load_balancer():
+    sys.path.append(os.path.join(ROOT, 'load-balancer'))
+    spec = importlib.util.spec_from_file_location('load_balancer_app', os.path.join(ROOT, 'load-balancer', 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.main()
+
+def run_monitoring(replica_id, results):
+    from rabbitmq_client import RabbitMQ
+    alerts = RabbitMQ('monitoring-service', 'overconsumption_alerts', 'rabbitmq-service')
+
+    def handle(message):
+        readings = message['data']['readings'] if message['type'] == 'consumption_batch' else [message['data']]
+        for data in readings:
+            results.put((replica_id, time.time() - data['sent_at']))
+            if data['consumption'] > THRESHOLD:
+                alerts.sendMessageAsync('overconsumption_alert', {'device_id': data['device_id'], 'consumption': data['consumption']})
+
+    RabbitMQ('monitoring-service', 'monitoring_ingest', COLLECTION_HOST, exchange_type='direct',
+             routing_key=f'replica{replica_id}', group='monitoring-service').consumeMessage(handle)
+
+def run_messages(results):
+    from rabbitmq_client import RabbitMQ
+    RabbitMQ('messages-service', 'overconsumption_alerts', 'rabbitmq-service').consumeMessage(lambda message: results.put(('alert', 0)))
+
+def run_role(role, results, args):
+    quiet()
+    if role == 'load-balancer':
+        run_load_balancer()
+    elif role == 'messages':
+        run_messages(results)
+    else:
+        run_monitoring(int(role), results)
+    while True:
+        time.sleep(60)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readings', type=int, default=5000)
+    parser.add_argument('--subprocess', action='store_true', help="run each service in its own process")
+    parser.add_argument('--port', type=int, default=5673)
+    args = parser.parse_args()
+
+    out = sys.stdout
+    roles = ['load-balancer', 'messages'] + [str(replica) for replica in range(1, REPLICAS + 1)]
+    server = None
+    if args.subprocess:
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'shared', 'memory_broker.py'), '--port', str(args.port)], stdout=subprocess.DEVNULL)
+        time.sleep(1)
+        os.environ['RABBIT_BROKER'] = f'memory://127.0.0.1:{args.port}'
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        processes = [context.Process(target=run_role, args=(role, results, args), daemon=True) for role in roles]
+        for process in processes:
+            process.start()
+        time.sleep(3)
+    else:
+        os.environ['RABBIT_BROKER'] = 'memory'
+        import queue
+        import threading
+        results = queue.Queue()
+        for role in roles:
+            threading.Thread(target=run_role, args=(role, results, args), daemon=True).start()
+        time.sleep(1)
+
+    quiet()
+    from rabbitmq_client import RabbitMQ
+    producer = RabbitMQ('simulator-service', 'consumption_data', COLLECTION_HOST)
+    start = time.time()
+    for index in range(args.readings):
+        consumption = 120.0 if index % 10 == 0 else 50.0
+        producer.sendMessage('consumption_reading', {'device_id': index % 1000, 'auth_id': 1, 'consumption': consumption, 'sent_at': time.time()})
+    publish_elapsed = time.time() - start
+
+    latencies = []
+    per_replica = {}
+    alerts = 0
+    expected_alerts = len(range(0, args.readings, 10))
+    while len(latencies) < args.readings or alerts < expected_alerts:
+        source, latency = results.get(timeout=60)
+        if source == 'alert':
+            alerts += 1
+        else:
+            latencies.append(latency)
+            per_replica[source] = per_replica.get(source, 0) + 1
+    elapsed = time.time() - start
+
+    sys.stdout = out
+    print(f"mode:               {'subprocess' if args.subprocess else 'in-process'}")
+    print(f"readings:           {args.readings}")
+    print(f"publish rate:       {args.readings / publish_elapsed:10.1f} msg/s")
+    print(f"end-to-end rate:    {args.readings / elapsed:10.1f} msg/s")
+    print(f"latency p50:        {percentile(latencies, 0.5) * 1000:10.2f} ms")
+    print(f"latency p99:        {percentile(latencies, 0.99) * 1000:10.2f} ms")
+    print(f"per replica:        {dict(sorted(per_replica.items()))}")
+    print(f"alerts delivered:   {alerts}")
+    if server is not None:
+        server.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# Measures RabbitMQ.sendMessage throughput with a connection per message versus
+# the pooled long-lived publisher connection.
+#
+#   RABBIT_HOST=localhost python benchmarks/publish_throughput.py --messages 2000
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+import rabbitmq_client
+from rabbitmq_client import RabbitMQ
+
+def run(pooled, messages):
+    rabbitmq_client.PUBLISHER_POOL = pooled
+    producer = RabbitMQ('publish-benchmark', 'publish_benchmark', os.environ.get('RABBIT_HOST', 'localhost'))
+    reading = {'device_id': 1, 'auth_id': 1, 'consumption': 1.234, 'timestamp': '2024-01-01T00:00:00'}
+
+    producer.sendMessage('consumption_reading', reading)
+    start = time.perf_counter()
+    for _ in range(messages):
+        producer.sendMessage('consumption_reading', reading)
+    elapsed = time.perf_counter() - start
+    return messages / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000)
+    args = parser.parse_args()
+
+    before = run(False, args.messages)
+    after = run(True, args.messages)
+    print(f"connection per message: {before:10.1f} msg/s")
+    print(f"pooled connection:      {after:10.1f} msg/s")
+    print(f"speedup:                {after / before:10.1f}x")
+
+if __name__ == '__main__':
+    main()
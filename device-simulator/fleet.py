@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+import multiprocessing
+import log_utils
+from rabbitmq_client import RabbitMQ
+from simulator import DEVICE_EVENTS_HOST, SIMULATOR_SEED, ConsumptionSimulator
+
+SIMULATOR_SHARDS = int(os.environ.get('SIMULATOR_SHARDS', 0))
+SYNTHETIC_DEVICES = int(os.environ.get('SIMULATOR_SYNTHETIC_DEVICES', 0))
+SYNTHETIC_DEVICE_OFFSET = int(os.environ.get('SIMULATOR_SYNTHETIC_OFFSET', 1000000))
+SYNTHETIC_AUTH_ID = int(os.environ.get('SIMULATOR_SYNTHETIC_AUTH_ID', 0))
+SYNTHETIC_MAX_CONSUMPTION = float(os.environ.get('SIMULATOR_SYNTHETIC_MAX_CONSUMPTION', 100))
+REGISTER_SYNTHETIC = os.environ.get('SIMULATOR_REGISTER_SYNTHETIC', 'false').lower() in ('1', 'true', 'yes')
+
+log = log_utils.get_logger('device-simulator.fleet')
+
+def synthetic_devices(shard, shards):
+    first = SYNTHETIC_DEVICE_OFFSET
+    return {device_id: (SYNTHETIC_AUTH_ID, SYNTHETIC_MAX_CONSUMPTION)
+            for device_id in range(first, first + SYNTHETIC_DEVICES) if device_id % shards == shard}
+
+def register_synthetic_devices():
+    # Monitoring only stores readings for devices it has a mapping for.
+    producer = RabbitMQ('simulator-service', 'device_crud', DEVICE_EVENTS_HOST)
+    for device_id in range(SYNTHETIC_DEVICE_OFFSET, SYNTHETIC_DEVICE_OFFSET + SYNTHETIC_DEVICES):
+        producer.sendMessageAsync('add_device', {'device_id': device_id, 'auth_id': SYNTHETIC_AUTH_ID})
+    producer.async_publisher.flush()
+    log.info("Registered %d synthetic devices with monitoring", SYNTHETIC_DEVICES)
+
+def run_shard(shard, shards, start_at, interval, reports):
+    # Ticks are due at start_at + n * interval in every shard. A tick that overruns
+    # its slot is reported, and the slots it ran into are skipped rather than
+    # sent late in a burst, so the offered rate never silently drifts upward.
+    seed = None if SIMULATOR_SEED is None else SIMULATOR_SEED + shard
+    simulator = ConsumptionSimulator(vectorized=True, shard=shard, shards=shards, synthetic=synthetic_devices(shard, shards), seed=seed)
+    simulator.build_arrays()
+    simulator.subscribe_device_events()
+    tick = 0
+    while True:
+        delay = start_at + tick * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        began = time.time()
+        simulator.sync_devices()
+        simulator.send_vectorized()
+        finished = time.time()
+
+        tick += 1
+        missed = 0
+        if finished > start_at + tick * interval:
+            missed = int((finished - start_at) // interval) - tick + 1
+            log.warning("Shard %d tick took %.2fs, missed %d deadline(s) of %ss", shard, finished - began, missed, interval)
+            tick += missed
+        reports.put((shard, len(simulator.device_ids), finished - began, missed))
+
+class ShardedSimulator():
+    # Runs the virtual device population as SIMULATOR_SHARDS processes, each
+    # owning device_id % shards == shard, and aggregates their tick reports.
+    def __init__(self, shards=SIMULATOR_SHARDS, interval=5):
+        self.shards = shards
+        self.interval = interval
+        self.processes = []
+        self.shard_stats = {shard: {'devices': 0, 'ticks': 0, 'missed_deadlines': 0, 'last_tick_seconds': None, 'max_tick_seconds': 0.0}
+                            for shard in range(shards)}
+
+    def start(self):
+        if REGISTER_SYNTHETIC and SYNTHETIC_DEVICES:
+            register_synthetic_devices()
+        context = multiprocessing.get_context('spawn')
+        reports = context.Queue()
+        start_at = time.time() + 1
+        for shard in range(self.shards):
+            process = context.Process(target=run_shard, args=(shard, self.shards, start_at, self.interval, reports), daemon=True)
+            process.start()
+            self.processes.append(process)
+        threading.Thread(target=self.collect, args=(reports,), daemon=True).start()
+        log.info("Started %d simulator shards with %d synthetic devices, ticking every %ss", self.shards, SYNTHETIC_DEVICES, self.interval)
+        return self
+
+    def collect(self, reports):
+        while True:
+            shard, devices, duration, missed = reports.get()
+            stats = self.shard_stats[shard]
+            stats['devices'] = devices
+            stats['ticks'] += 1
+            stats['missed_deadlines'] += missed
+            stats['last_tick_seconds'] = round(duration, 3)
+            stats['max_tick_seconds'] = round(max(stats['max_tick_seconds'], duration), 3)
+            if shard == 0:
+                log.info("Simulator fleet: %s", self.stats())
+
+    def stats(self):
+        shards = list(self.shard_stats.values())
+        return {
+            'shards': self.shards,
+            'interval_seconds': self.interval,
+            'devices': sum(stats['devices'] for stats in shards),
+            'target_readings_per_second': round(sum(stats['devices'] for stats in shards) / self.interval, 1),
+            'missed_deadlines': sum(stats['missed_deadlines'] for stats in shards),
+            'alive': sum(1 for process in self.processes if process.is_alive()),
+            'per_shard': self.shard_stats,
+        }
@@ -0,0 +1,173 @@
+import os
+import time
+import socket
+import threading
+from datetime import datetime
+import log_utils
+
+# constant:RATE | ramp:FROM:TO:SECONDS | step:RATE,RATE,...:SECONDS_PER_STEP (readings/s)
+LOAD_PROFILE = os.environ.get('SIMULATOR_LOAD_PROFILE', '')
+LOAD_DURATION = float(os.environ.get('SIMULATOR_LOAD_DURATION', 0))
+# Scheduling granularity: readings due within one slice are sent back to back.
+LOAD_SLICE = 0.01
+
+log = log_utils.get_logger('device-simulator.loadgen')
+
+class RateProfile():
+    def __init__(self, kind, rates, seconds, spec=None):
+        self.spec = spec or kind
+        self.kind = kind
+        self.rates = rates
+        self.seconds = seconds
+
+    def rate(self, elapsed):
+        if self.kind == 'constant':
+            return self.rates[0]
+        if self.kind == 'ramp':
+            start, end = self.rates
+            return start + (end - start) * min(elapsed / self.seconds, 1.0)
+        return self.rates[min(int(elapsed // self.seconds), len(self.rates) - 1)]
+
+    def expected(self, elapsed):
+        # Readings that should have been sent after `elapsed` seconds.
+        if self.kind == 'constant':
+            return self.rates[0] * elapsed
+        if self.kind == 'ramp':
+            start, end = self.rates
+            ramp = min(elapsed, self.seconds)
+            total = start * ramp + (end - start) * ramp * ramp / (2 * self.seconds)
+            return total + end * max(elapsed - self.seconds, 0)
+        total = 0.0
+        for index, rate in enumerate(self.rates):
+            step_start = index * self.seconds
+            step_end = float('inf') if index == len(self.rates) - 1 else step_start + self.seconds
+            if elapsed <= step_start:
+                break
+            total += rate * (min(elapsed, step_end) - step_start)
+        return total
+
+    @classmethod
+    def parse(cls, spec):
+        kind, _, rest = spec.partition(':')
+        parts = rest.split(':')
+        try:
+            if kind == 'constant' and len(parts) == 1:
+                return cls(kind, [float(parts[0])], None, spec)
+            if kind == 'ramp' and len(parts) == 3:
+                return cls(kind, [float(parts[0]), float(parts[1])], float(parts[2]), spec)
+            if kind == 'step' and len(parts) == 2:
+                return cls(kind, [float(rate) for rate in parts[0].split(',')], float(parts[1]), spec)
+        except ValueError:
+            pass
+        raise ValueError(f"Invalid load profile '{spec}', expected constant:RATE, ramp:FROM:TO:SECONDS or step:RATE,RATE,...:SECONDS")
+
+class PacedSender():
+    # Shared by the load generator and the trace replayer: both send open loop
+    # on their own schedule and tag each reading with run_id, a global seq, a
+    # per-device device_seq and a high-resolution sent_at for the monitoring
+    # ingest probe. Subclasses implement run() and add their own stats.
+    def __init__(self, producer, run_id):
+        self.producer = producer
+        self.run_id = run_id
+        self.sent = 0
+        self.failed = 0
+        self.behind = 0
+        self.started_at = None
+        self.finished_at = None
+        self.device_seqs = {}
+
+    def send(self, device_id, auth_id, consumption):
+        device_seq = self.device_seqs.get(device_id, 0)
+        self.device_seqs[device_id] = device_seq + 1
+        message_data = {
+            'device_id': device_id,
+            'auth_id': auth_id,
+            'consumption': consumption,
+            'timestamp': datetime.utcnow().isoformat(),
+            'run_id': self.run_id,
+            'seq': self.sent,
+            'device_seq': device_seq,
+            'sent_at': time.time()
+        }
+        self.sent += 1
+        try:
+            self.producer.sendMessage('consumption_reading', message_data)
+        except Exception as e:
+            self.failed += 1
+            log.error("Failed to send consumption message: %s", e)
+
+    def start(self, on_finished=None):
+        # on_finished runs once run() returns, e.g. to close a trace being recorded.
+        def run():
+            try:
+                self.run()
+            finally:
+                if on_finished is not None:
+                    on_finished()
+        threading.Thread(target=run, daemon=True).start()
+        return self
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def stats(self):
+        elapsed = self.elapsed()
+        return {
+            'run_id': self.run_id,
+            'elapsed_seconds': round(elapsed, 1),
+            'sent': self.sent,
+            'failed': self.failed,
+            'finished': self.finished_at is not None,
+            'achieved_rate': round(self.sent / elapsed, 1) if elapsed else 0.0,
+            'behind_schedule': max(self.behind, 0),
+        }
+
+class LoadGenerator(PacedSender):
+    # Open-loop generator: reading n is due when the profile's cumulative count
+    # reaches n, regardless of how long earlier sends took, so a slow pipeline
+    # shows up as latency rather than as a quietly lower offered rate.
+    def __init__(self, simulator, producer, profile, duration=LOAD_DURATION, synthetic=None):
+        super().__init__(producer, f"{socket.gethostname()}-{int(time.time())}")
+        self.simulator = simulator
+        self.profile = profile
+        self.duration = duration
+        self.synthetic = synthetic or {}
+
+    def population(self):
+        devices = [(device_id, config['auth_id'], config['max_consumption']) for device_id, config in self.simulator.device_configs.items()]
+        devices += [(device_id, auth_id, max_consumption) for device_id, (auth_id, max_consumption) in self.synthetic.items()]
+        return devices
+
+    def run(self):
+        self.simulator.fetch_devices()
+        devices = self.population()
+        if not devices:
+            log.error("Load generator has no devices to send readings for")
+            return
+        log.info("Load generator %s starting: %s over %d devices", self.run_id, self.profile.spec, len(devices))
+
+        self.started_at = time.monotonic()
+        next_report = self.started_at + 10
+        while True:
+            now = time.monotonic()
+            elapsed = now - self.started_at
+            if self.duration and elapsed >= self.duration:
+                break
+            due = int(self.profile.expected(elapsed))
+            self.behind = due - self.sent
+            while self.sent < due:
+                device_id, auth_id, max_consumption = devices[self.sent % len(devices)]
+                self.send(device_id, auth_id, self.simulator.generate_consumption(device_id, max_consumption))
+            if now >= next_report:
+                log.info("Load generator: %s", self.stats())
+                next_report = now + 10
+            time.sleep(LOAD_SLICE)
+        self.finished_at = time.monotonic()
+        log.info("Load generator finished: %s", self.stats())
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(profile=self.profile.spec, target_rate=round(self.profile.rate(self.elapsed()), 1))
+        return stats
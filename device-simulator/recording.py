@@ -0,0 +1,133 @@
+import os
+import gzip
+import json
+import zlib
+import time
+import atexit
+import bisect
+import socket
+import struct
+import threading
+from datetime import datetime
+import log_utils
+from loadgen import LOAD_SLICE, PacedSender
+
+# Record every reading sent to SIMULATOR_RECORD, or replay SIMULATOR_REPLAY
+# instead of simulating. Replay speed is a multiple of the recorded pace, 0 = as fast as possible.
+TRACE_RECORD = os.environ.get('SIMULATOR_RECORD', '')
+TRACE_REPLAY = os.environ.get('SIMULATOR_REPLAY', '')
+REPLAY_SPEED = float(os.environ.get('SIMULATOR_REPLAY_SPEED', 1))
+
+# Trace file: gzip of magic, version, a length-prefixed JSON header and then
+# fixed-size records of (seconds since recording started, device_id, auth_id, consumption).
+TRACE_MAGIC = b'DMSTRACE'
+TRACE_VERSION = 1
+HEADER = struct.Struct('<BI')
+RECORD = struct.Struct('<dqqd')
+
+log = log_utils.get_logger('device-simulator.recording')
+
+class TraceWriter():
+    # Closed when the run that feeds it ends, or at exit; rabbitmq_client turns
+    # SIGTERM into a normal exit, so a stopped pod also gets a complete file.
+    def __init__(self, path, metadata=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, 'wb')
+        header = json.dumps(dict(metadata or {}, recorded_at=datetime.utcnow().isoformat(), host=socket.gethostname())).encode()
+        self.file.write(TRACE_MAGIC + HEADER.pack(TRACE_VERSION, len(header)) + header)
+        self.started_at = time.monotonic()
+        self.records = 0
+        atexit.register(self.close)
+
+    def write(self, device_id, auth_id, consumption):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD.pack(time.monotonic() - self.started_at, device_id, auth_id, consumption))
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                log.info("Recorded %d readings to %s", self.records, self.path)
+
+class RecordingProducer():
+    # Stands in for the simulator's RabbitMQ producer: readings are sent on
+    # unchanged and then written to the trace. A reading that failed to send is
+    # not recorded, and a failed trace write never stops the simulation.
+    def __init__(self, producer, writer):
+        self.producer = producer
+        self.writer = writer
+
+    def sendMessage(self, type, data):
+        result = self.producer.sendMessage(type, data)
+        if type == 'consumption_reading':
+            try:
+                self.writer.write(data['device_id'], data['auth_id'], data['consumption'])
+            except Exception as e:
+                log.error("Failed to record reading for device %s: %s", data.get('device_id'), e)
+        return result
+
+def read_trace(path):
+    # Returns (metadata, [(offset, device_id, auth_id, consumption), ...]).
+    # Decompressed with zlib rather than gzip.open so a trace whose writer was
+    # killed before closing it still yields every complete record.
+    decompressor = zlib.decompressobj(wbits=31)
+    chunks = []
+    with open(path, 'rb') as trace:
+        for chunk in iter(lambda: trace.read(1 << 20), b''):
+            chunks.append(decompressor.decompress(chunk))
+            if decompressor.eof:
+                break
+    data = b''.join(chunks)
+    if not decompressor.eof:
+        log.warning("Trace %s was not closed cleanly, keeping the complete records", path)
+
+    start = len(TRACE_MAGIC) + HEADER.size
+    if data[:len(TRACE_MAGIC)] != TRACE_MAGIC or len(data) < start:
+        raise ValueError(f"{path} is not a simulator trace")
+    version, header_length = HEADER.unpack_from(data, len(TRACE_MAGIC))
+    if version != TRACE_VERSION:
+        raise ValueError(f"Unsupported trace version {version} in {path}")
+    if len(data) < start + header_length:
+        raise ValueError(f"Trace {path} ends inside its header")
+    metadata = json.loads(data[start:start + header_length])
+    body = memoryview(data)[start + header_length:]
+    usable = len(body) - len(body) % RECORD.size
+    if usable != len(body):
+        log.warning("Trace %s ends in a partial record, ignoring it", path)
+    return metadata, list(RECORD.iter_unpack(body[:usable]))
+
+class TraceReplayer(PacedSender):
+    # Sends a recorded trace open loop: record n is due at start + offset / speed,
+    # however long earlier sends took. Consumptions and their order are exactly
+    # as recorded; timestamps are taken at send time.
+    def __init__(self, path, producer, speed=REPLAY_SPEED):
+        super().__init__(producer, f"replay-{socket.gethostname()}-{int(time.time())}")
+        self.path = path
+        self.speed = speed
+        self.metadata, self.records = read_trace(path)
+
+    def run(self):
+        log.info("Replaying %d readings from %s at %s", len(self.records), self.path, f"{self.speed}x" if self.speed else "max speed")
+        offsets = [record[0] for record in self.records]
+        self.started_at = time.monotonic()
+        for offset, device_id, auth_id, consumption in self.records:
+            if self.speed:
+                elapsed = time.monotonic() - self.started_at
+                if offset / self.speed - elapsed > LOAD_SLICE:
+                    self.behind = 0
+                    time.sleep(offset / self.speed - elapsed)
+                else:
+                    self.behind = max(bisect.bisect_right(offsets, elapsed * self.speed) - self.sent, 0)
+            self.send(device_id, auth_id, consumption)
+        self.finished_at = time.monotonic()
+        log.info("Replay finished: %s", self.stats())
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(trace=self.path, speed=self.speed, recorded=len(self.records))
+        return stats
@@ -0,0 +1,245 @@
+import requests
+import time
+import random
+import threading
+import os
+from datetime import datetime
+from rabbitmq_client import RabbitMQ
+import log_utils
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = log_utils.get_logger('device-simulator.simulator')
+
+rabbitmq_producer = RabbitMQ('simulator-service', 'consumption_data', os.environ.get('RABBIT_HOST', 'collection-rabbitmq-service.default.svc.cluster.local'))
+SIMULATION_INTERVAL = 5  
+# Generate every device's reading for a tick in one NumPy batch instead of a per-device Python loop.
+SIMULATOR_VECTORIZED = os.environ.get('SIMULATOR_VECTORIZED', 'false').lower() in ('1', 'true', 'yes')
+# A seed plus a pinned hour of day make generated readings repeatable run to run.
+SIMULATOR_SEED = int(os.environ['SIMULATOR_SEED']) if os.environ.get('SIMULATOR_SEED') else None
+SIMULATOR_HOUR = int(os.environ['SIMULATOR_HOUR']) if os.environ.get('SIMULATOR_HOUR') else None
+DEVICE_EVENTS_HOST = os.environ.get('DEVICE_EVENTS_RABBIT_HOST', 'rabbitmq-service')
+# Simulators refetch the full device list this often; device_crud events keep it current in between.
+DEVICE_REFRESH_INTERVAL = float(os.environ.get('SIMULATOR_DEVICE_REFRESH', 300))
+
+class ConsumptionSimulator:
+    def __init__(self, vectorized=SIMULATOR_VECTORIZED, shard=0, shards=1, synthetic=None, producer=None, seed=SIMULATOR_SEED, hour=SIMULATOR_HOUR):
+        self.device_configs = {} 
+        # device_configs is refetched in full every DEVICE_REFRESH_INTERVAL and
+        # kept current from device_crud events in between.
+        self.devices_lock = threading.Lock()
+        self.devices_changed = False
+        self.pending_events = None
+        self.next_resync = 0
+        self.vectorized = vectorized
+        self.producer = producer or rabbitmq_producer
+        self.random = random.Random(seed)
+        self.hour = hour
+        # In sharded mode this simulator only sends for devices with device_id % shards == shard,
+        # plus synthetic devices ({device_id: (auth_id, max_consumption)}) unknown to the device service.
+        self.shard = shard
+        self.shards = shards
+        self.synthetic = synthetic or {}
+        if vectorized:
+            if np is None:
+                raise RuntimeError("SIMULATOR_VECTORIZED requires numpy; install it with 'pip install numpy'")
+            self.rng = np.random.default_rng(seed)
+            self.device_ids = []
+            self.auth_ids = []
+            self.max_consumptions = np.empty(0)
+        
+    def device_config(self, device):
+        device_id = device['device_id']
+        return {
+            'max_consumption': float(device.get('maxConsumption', 100)),
+            'auth_id': device['auth_id'],
+            'name': device.get('name', f'Device {device_id}')
+        }
+
+    def fetch_devices(self):
+        # Events that arrive while the request is in flight may be newer than
+        # the response, so they are applied again on top of it.
+        with self.devices_lock:
+            self.pending_events = []
+        try:
+            response = requests.get("http://flask-device-service.default.svc.cluster.local/devices")
+            if response.status_code == 200:
+                devices = response.json().get('devices', [])
+                log.info("Fetched %d devices", len(devices))
+
+                device_configs = {}
+                for device in devices:
+                    config = device_configs[device['device_id']] = self.device_config(device)
+                    log.debug("Device %s (%s): max consumption = %s kWh", device['device_id'], config['name'], config['max_consumption'])
+
+                with self.devices_lock:
+                    self.device_configs = device_configs
+                    for message in self.pending_events:
+                        self.apply_device_event(message)
+                    self.pending_events = None
+                    self.devices_changed = False
+                    if self.vectorized:
+                        self.build_arrays()
+                return True
+            else:
+                log.warning("Failed to fetch devices: %s", response.status_code)
+        except Exception as e:
+            log.error("Error fetching devices: %s", e)
+        with self.devices_lock:
+            self.pending_events = None
+        return False
+
+    def apply_device_event(self, message):
+        # add_device without maxConsumption comes from synthetic device
+        # registration, not the device service, and is not simulated here.
+        message_type = message.get('type')
+        data = message.get('data', {})
+        device_id = data.get('device_id')
+        if message_type in ('add_device', 'update_device') and 'maxConsumption' in data:
+            self.device_configs[device_id] = self.device_config(data)
+        elif message_type == 'delete_device' and device_id in self.device_configs:
+            del self.device_configs[device_id]
+        else:
+            return False
+        self.devices_changed = True
+        return True
+
+    def handle_device_event(self, message):
+        with self.devices_lock:
+            if self.pending_events is not None:
+                self.pending_events.append(message)
+            applied = self.apply_device_event(message)
+        if applied:
+            log.info("Applied %s for device %s", message.get('type'), message.get('data', {}).get('device_id'))
+
+    def subscribe_device_events(self):
+        consumer = RabbitMQ('simulator-service', 'device_crud', DEVICE_EVENTS_HOST)
+        consumer.consumeMessage(self.handle_device_event, workers=1)
+
+    def sync_devices(self):
+        # Full refetch when due or after a failed one; otherwise only rebuild
+        # the send arrays if device events changed the device list.
+        now = time.monotonic()
+        if now >= self.next_resync:
+            if self.fetch_devices():
+                self.next_resync = now + DEVICE_REFRESH_INTERVAL
+            return
+        if self.vectorized and self.devices_changed:
+            with self.devices_lock:
+                self.devices_changed = False
+                self.build_arrays()
+
+    def build_arrays(self):
+        device_ids = [device_id for device_id in self.device_configs if device_id % self.shards == self.shard]
+        self.device_ids = device_ids + list(self.synthetic)
+        self.auth_ids = [self.device_configs[device_id]['auth_id'] for device_id in device_ids] + [auth_id for auth_id, _ in self.synthetic.values()]
+        self.max_consumptions = np.array([self.device_configs[device_id]['max_consumption'] for device_id in device_ids]
+                                         + [max_consumption for _, max_consumption in self.synthetic.values()], dtype=float)
+
+    def get_hourly_multiplier(self, hour):
+        if 0 <= hour < 6:  
+            return 0.2  
+        elif 6 <= hour < 9: 
+            return 0.5 
+        elif 9 <= hour < 17:  
+            return 0.7  
+        elif 17 <= hour < 21:  
+            return 1.0  
+        else:  
+            return 0.4 
+    
+    def current_hour(self):
+        return datetime.now().hour if self.hour is None else self.hour
+
+    def generate_consumption(self, device_id, max_consumption):
+        hour = self.current_hour()
+        
+        hourly_multiplier = self.get_hourly_multiplier(hour)
+        
+        variation = self.random.uniform(0.8, 1.2)
+        
+        consumption = max_consumption * hourly_multiplier * variation
+        
+        # 10% chance to simulate overconsumption (exceeding max)
+        if self.random.random() < 0.1:
+            overconsumption_multiplier = self.random.uniform(1.1, 1.5)
+            consumption = max_consumption * overconsumption_multiplier
+            log.info("OVERCONSUMPTION SIMULATED for device %s: %.3f kWh (max: %s kWh)", device_id, consumption, max_consumption, extra=log_utils.SAMPLED)
+        else:
+            consumption = min(consumption, max_consumption)
+        
+        consumption = max(0.1, consumption)
+        
+        return round(consumption, 3)
+    
+    def generate_consumptions(self, max_consumptions):
+        # Same profile as generate_consumption, drawn for all devices at once.
+        size = len(max_consumptions)
+        hourly_multiplier = self.get_hourly_multiplier(self.current_hour())
+
+        variation = self.rng.uniform(0.8, 1.2, size)
+        consumptions = np.minimum(max_consumptions * hourly_multiplier * variation, max_consumptions)
+
+        # 10% chance per device to simulate overconsumption (exceeding max)
+        overconsumption = self.rng.random(size) < 0.1
+        consumptions[overconsumption] = max_consumptions[overconsumption] * self.rng.uniform(1.1, 1.5, int(overconsumption.sum()))
+
+        return np.round(np.maximum(consumptions, 0.1), 3), overconsumption
+
+    def send_vectorized(self):
+        consumptions, overconsumption = self.generate_consumptions(self.max_consumptions)
+        if overconsumption.any():
+            log.info("OVERCONSUMPTION SIMULATED for %d of %d devices", int(overconsumption.sum()), len(self.device_ids))
+
+        timestamp = datetime.utcnow().isoformat()
+        for device_id, auth_id, consumption in zip(self.device_ids, self.auth_ids, consumptions.tolist()):
+            message_data = {
+                'device_id': device_id,
+                'auth_id': auth_id,
+                'consumption': consumption,
+                'timestamp': timestamp
+            }
+            try:
+                self.producer.sendMessage('consumption_reading', message_data)
+            except Exception as send_error:
+                log.error("Failed to send consumption message: %s", send_error)
+
+    def simulate_and_send(self):
+        while True:
+            try:
+                self.sync_devices()
+                
+                if self.vectorized:
+                    self.send_vectorized()
+                    time.sleep(SIMULATION_INTERVAL)
+                    continue
+
+                for device_id, device_config in list(self.device_configs.items()):
+                    auth_id = device_config['auth_id']
+                    max_consumption = device_config['max_consumption']
+                    
+                    consumption = self.generate_consumption(device_id, max_consumption)
+                    
+                    log.debug("Device %s (%s): %s kWh (max: %s kWh)", device_id, device_config['name'], consumption, max_consumption)
+                    
+                    message_data = {
+                        'device_id': device_id,
+                        'auth_id': auth_id,
+                        'consumption': consumption,
+                        'timestamp': datetime.utcnow().isoformat()
+                    }
+                    
+                    try:
+                        self.producer.sendMessage('consumption_reading', message_data)
+                        log.debug("Sent consumption data for device %s", device_id)
+                    except Exception as send_error:
+                        log.error("Failed to send consumption message: %s", send_error)
+                
+                time.sleep(SIMULATION_INTERVAL)
+                
+            except Exception as e:
+                log.exception("Error in simulation loop: %s", e)
+                time.sleep(60)
@@ -77,9 +77,12 @@ export function DeviceTable({ deviceForm, _users, devices, _setDevices, getDevic
         }
 
         const dateStr = selectedDate.toISOString().split('T')[0]; 
+        const nextDate = new Date(selectedDate);
+        nextDate.setDate(nextDate.getDate() + 1);
+        const nextDateStr = nextDate.toISOString().split('T')[0];
 
         try {
-            const response = await fetch(`/consumptions?user_id=${user.auth_id}&date=${dateStr}`, {
+            const response = await fetch(`/consumptions/series?user_id=${user.auth_id}&bucket=hour&from=${dateStr}&to=${nextDateStr}`, {
                 method: "GET",
                 headers: {
                     "Content-Type": "application/json",
@@ -93,30 +96,19 @@ export function DeviceTable({ deviceForm, _users, devices, _setDevices, getDevic
             }
             const data = await response.json();
             
-            const hourlyConsumption: { [hour: number]: number[] } = {};
+            // The monitoring service returns one pre-aggregated point per hour
+            const hourlyAverage: { [hour: number]: number } = {};
             
-            data?.consumptions?.forEach((consumption: any) => {
-                const timestamp = new Date(consumption.timestamp);
-                const hour = timestamp.getHours();
-                const consumptionValue = parseFloat(consumption.consumption);
-                
-                if (!hourlyConsumption[hour]) {
-                    hourlyConsumption[hour] = [];
-                }
-                hourlyConsumption[hour].push(consumptionValue);
+            data?.series?.forEach((point: any) => {
+                const hour = new Date(point.start).getHours();
+                hourlyAverage[hour] = point.average;
             });
             
-            // Calculate average consumption per hour
             const hourlyData = [];
             for (let hour = 0; hour < 24; hour++) {
-                const consumptions = hourlyConsumption[hour] || [];
-                const averageConsumption = consumptions.length > 0 
-                    ? consumptions.reduce((sum, val) => sum + val, 0) / consumptions.length 
-                    : 0;
-                
                 hourlyData.push({
                     hour,
-                    consumption: averageConsumption
+                    consumption: hourlyAverage[hour] ?? 0
                 });
             }
             
@@ -1,57 +1,98 @@
-from flask import Flask
-import pika
-import json
+from flask import Flask, jsonify
 import os
 import threading
 import sys
 sys.path.append('/app/shared')
 from rabbitmq_client import RabbitMQ
+import log_utils
+import message_codecs
+from routing import ROUTING_STRATEGY, ReplicaSet, make_router
 
 app = Flask(__name__)
+log = log_utils.get_logger('load-balancer')
+codec = message_codecs.get_codec(os.environ.get('RABBIT_CODEC', 'json'))
+host = os.environ.get('RABBIT_HOST', 'collection-rabbitmq-service.default.svc.cluster.local')
+# With LB_BATCH_SIZE > 1, readings are forwarded to each replica in consumption_batch envelopes.
+BATCH_SIZE = int(os.environ.get('LB_BATCH_SIZE', 0))
+BATCH_WAIT_MS = int(os.environ.get('LB_BATCH_WAIT_MS', 50))
 
-def handle_message(message, replica_count, current_replica):
+forwarder = RabbitMQ('load-balancer', 'monitoring_ingest', host, exchange_type='direct', codec=codec.name)
+replicas = ReplicaSet(forwarder)
+router = make_router(replicas)
+
+def handle_message(message, router, forwarder):
     try:
-        host = os.environ.get('RABBIT_HOST', 'collection-rabbitmq-service.default.svc.cluster.local')
-        port = int(os.environ.get('RABBIT_PORT', 5672))
-        username = os.environ.get('RABBIT_USER', 'admin')
-        password = os.environ.get('RABBIT_PASS', 'admin123')
-        
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=host, port=port, credentials=pika.PlainCredentials(username, password)))
-        pub_channel = connection.channel()
-        pub_channel.exchange_declare(exchange='monitoring_ingest', exchange_type='direct')
-        
-        replica_id = (current_replica[0] % replica_count) + 1
-        routing_key = f'replica{replica_id}'
-        current_replica[0] += 1
-        
-        body = json.dumps(message)
-        
-        pub_channel.basic_publish(
-            exchange='monitoring_ingest',
-            routing_key=routing_key,
-            body=body
-        )
-        print(f"Forwarded message to {routing_key}", flush=True)
-        
-        connection.close()
-        
+        routing_key = f'replica{router.route(message)}'
+
+        forwarder.publish(codec.encode(message), routing_key)
+        log.info("Forwarded message to %s", routing_key, extra=log_utils.SAMPLED)
+
     except Exception as e:
-        print(f"Error forwarding message: {str(e)}", flush=True)
+        log.error("Error forwarding message: %s", e)
+        raise
+
+def handle_batch(messages, router, forwarder):
+    # Groups readings by destination replica and forwards each group as one
+    # consumption_batch envelope. Returns the positions of readings whose
+    # envelope could not be published so consumeBatch retries only those.
+    groups = {}
+    failed = []
+    for position, message in enumerate(messages):
+        if message.get('type') != 'consumption_reading':
+            try:
+                handle_message(message, router, forwarder)
+            except Exception:
+                failed.append(position)
+            continue
+        groups.setdefault(router.route(message), []).append(position)
+
+    for replica, positions in groups.items():
+        routing_key = f'replica{replica}'
+        envelope = {
+            "type": "consumption_batch",
+            "data": {"readings": [messages[position].get('data') for position in positions]},
+            "sender": "load-balancer"
+        }
+        try:
+            forwarder.publish(codec.encode(envelope), routing_key)
+            log.info("Forwarded batch of %d readings to %s", len(positions), routing_key, extra=log_utils.SAMPLED)
+        except Exception as e:
+            log.error("Error forwarding batch to %s: %s", routing_key, e)
+            failed.extend(positions)
+    return failed
+
+def reroute_stranded(body, properties):
+    # Messages taken back from a dropped replica's queue. Envelopes are split
+    # into their readings so each one is routed again on its own.
+    message = message_codecs.decode(body, properties.content_type)
+    if message.get('type') != 'consumption_batch':
+        handle_message(message, router, forwarder)
+        return
+    readings = [{"type": "consumption_reading", "data": reading, "sender": message.get('sender')} for reading in message['data']['readings']]
+    if handle_batch(readings, router, forwarder):
+        raise RuntimeError(f"Could not re-route all {len(readings)} readings of a stranded batch")
+
+@app.route('/metrics', methods=["GET"])
+def metrics():
+    return jsonify({'strategy': ROUTING_STRATEGY, 'live_replicas': list(replicas.replicas), **replicas.metrics()})
 
 def main():
-    replica_count = 3 
-    current_replica = [0]  
-    
-    rabbitmq_consumer = RabbitMQ('load-balancer', 'consumption_data', os.environ.get('RABBIT_HOST', 'collection-rabbitmq-service.default.svc.cluster.local'))
-    
+    replicas.reroute = reroute_stranded
+    replicas.start()
+    rabbitmq_consumer = RabbitMQ('load-balancer', 'consumption_data', host, group='load-balancer')
+
+    if BATCH_SIZE > 1:
+        rabbitmq_consumer.consumeBatch(lambda messages: handle_batch(messages, router, forwarder), max_batch=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS)
+        return
+
     def message_handler(message):
-        handle_message(message, replica_count, current_replica)
-    
+        handle_message(message, router, forwarder)
+
     rabbitmq_consumer.consumeMessage(message_handler)
 
 if __name__ == '__main__':
     consumer_thread = threading.Thread(target=main, daemon=True)
     consumer_thread.start()
     
-    print("Load Balancer starting...", flush=True)
+    log.info("Load Balancer starting...")
     app.run(debug=False, host='0.0.0.0', port=5001)
\ No newline at end of file
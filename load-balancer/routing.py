@@ -0,0 +1,292 @@
+import os
+import bisect
+import hashlib
+import itertools
+import collections
+import threading
+import time
+import pika
+import log_utils
+from rabbitmq_client import PUBLISH_TIMEOUT
+
+MONITORING_REPLICAS = int(os.environ.get('MONITORING_REPLICAS', 3))
+MONITORING_GROUP = os.environ.get('MONITORING_GROUP', 'monitoring-service')
+MEMBERSHIP_INTERVAL = float(os.environ.get('LB_MEMBERSHIP_INTERVAL', 2))
+MEMBERSHIP_GRACE = int(os.environ.get('LB_MEMBERSHIP_GRACE', 2))
+# Most stranded messages re-routed per probe cycle, so a long queue is drained
+# over several cycles without holding up membership updates.
+DRAIN_LIMIT = int(os.environ.get('LB_DRAIN_LIMIT', 500))
+ROUTING_STRATEGY = os.environ.get('LB_ROUTING', 'hash')
+VIRTUAL_NODES = int(os.environ.get('LB_VIRTUAL_NODES', 160))
+
+log = log_utils.get_logger('load-balancer.routing')
+
+class ReplicaSet():
+    # Live set of monitoring replicas, refreshed in the background from the
+    # durable replica{N} group queues: a replica is live while its queue has a
+    # consumer. StatefulSet ordinals are contiguous, so probing continues past
+    # the configured count until the first missing queue and scaling up or down
+    # needs no restart. Each probe also samples queue depth, from which the
+    # drain rate of every replica is estimated. Readings left in the queue of a
+    # replica that was dropped are handed to self.reroute, if set.
+    def __init__(self, rabbitmq, exchange='monitoring_ingest', configured=MONITORING_REPLICAS, group=MONITORING_GROUP, interval=MEMBERSHIP_INTERVAL, grace=MEMBERSHIP_GRACE, drain_limit=DRAIN_LIMIT):
+        self.rabbitmq = rabbitmq
+        self.exchange = exchange
+        self.configured = configured
+        self.group = group
+        self.interval = interval
+        self.grace = grace
+        self.drain_limit = drain_limit
+        self.connection = None
+        self.channel = None
+        self.idle = {}
+        self.replicas = tuple(range(1, configured + 1))
+        self.routed = collections.Counter()
+        self.depths = {}
+        self.consumers = {}
+        self.drain_rates = {}
+        self.routed_at_sample = {}
+        self.sampled_at = None
+        self.reroute = None
+        self.rerouted = 0
+
+    def queue_name(self, replica):
+        return f"{self.group}.{self.exchange}.replica{replica}"
+
+    def probe_channel(self):
+        # One long-lived connection for membership probes, reopened only after
+        # it fails, instead of a new connection every interval.
+        if self.connection is None or self.connection.is_closed:
+            self.reset()
+            self.connection = self.rabbitmq.connect_with_retry(self.rabbitmq.host, self.rabbitmq.port, timeout=PUBLISH_TIMEOUT)
+        if self.channel is None or self.channel.is_closed:
+            self.channel = self.connection.channel()
+        return self.channel
+
+    def reset(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+        self.channel = None
+
+    def probe(self):
+        # Returns {replica: (message_count, consumer_count)} for every replica queue that exists.
+        try:
+            channel = self.probe_channel()
+            queues = {}
+            replica = 1
+            while True:
+                try:
+                    result = channel.queue_declare(queue=self.queue_name(replica), passive=True)
+                    queues[replica] = (result.method.message_count, result.method.consumer_count)
+                except pika.exceptions.ChannelClosedByBroker:
+                    # A failed passive declare closes the channel.
+                    channel = self.channel = self.connection.channel()
+                    if replica >= self.configured:
+                        return queues
+                replica += 1
+        except pika.exceptions.AMQPError:
+            self.reset()
+            raise
+
+    def refresh(self):
+        queues = self.probe()
+        live = []
+        for replica, (_, consumers) in sorted(queues.items()):
+            # A replica without a consumer (restarting pod, scaled-down ordinal)
+            # is dropped once `grace` consecutive probes find no consumer; one
+            # whose queue is gone is dropped at once.
+            self.idle[replica] = 0 if consumers else self.idle.get(replica, 0) + 1
+            if self.idle[replica] < self.grace:
+                live.append(replica)
+        live = tuple(live) or tuple(sorted(queues)) or self.replicas
+        self.sample(queues)
+        if live != self.replicas:
+            log.info("Monitoring replicas changed from %s to %s", list(self.replicas), list(live))
+            self.replicas = live
+        if self.reroute is not None:
+            budget = self.drain_limit
+            for replica, (depth, consumers) in sorted(queues.items()):
+                if budget > 0 and depth and not consumers and replica not in self.replicas:
+                    budget -= self.drain(replica, budget)
+        return queues
+
+    def drain(self, replica, limit):
+        # Readings routed to a replica before it was dropped would otherwise sit
+        # in its durable queue until that ordinal consumes again, so up to
+        # `limit` of them are taken off and routed again over the forwarder's
+        # connection. A message is acked only after self.reroute has forwarded
+        # it; if the channel was replaced meanwhile, the broker redelivers it.
+        publisher = self.rabbitmq.publisher()
+        queue_name = self.queue_name(replica)
+
+        def get(channel):
+            return channel, channel.basic_get(queue=queue_name, auto_ack=False)
+
+        def settle(channel, delivery_tag, ack):
+            def operation(current):
+                if current is not channel:
+                    return
+                if ack:
+                    current.basic_ack(delivery_tag=delivery_tag)
+                else:
+                    current.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            publisher.call(operation)
+
+        drained = 0
+        try:
+            while drained < limit:
+                channel, (method, properties, body) = publisher.call(get)
+                if method is None:
+                    break
+                try:
+                    self.reroute(body, properties)
+                except Exception:
+                    settle(channel, method.delivery_tag, False)
+                    raise
+                settle(channel, method.delivery_tag, True)
+                drained += 1
+        finally:
+            self.rerouted += drained
+            if drained:
+                log.info("Re-routed %d messages stranded on replica%d", drained, replica)
+        return drained
+
+    def sample(self, queues):
+        # Messages drained since the last probe = old depth + messages routed
+        # there since - new depth. Smoothed so one slow probe does not flip routing.
+        now = time.monotonic()
+        routed = dict(self.routed)
+        for replica, (depth, consumers) in queues.items():
+            if self.sampled_at is not None and replica in self.depths:
+                drained = self.depths[replica] + routed.get(replica, 0) - self.routed_at_sample.get(replica, 0) - depth
+                rate = max(drained, 0) / max(now - self.sampled_at, 1e-3)
+                previous = self.drain_rates.get(replica)
+                self.drain_rates[replica] = rate if previous is None else 0.5 * previous + 0.5 * rate
+        self.depths = {replica: depth for replica, (depth, _) in queues.items()}
+        self.consumers = {replica: consumers for replica, (_, consumers) in queues.items()}
+        self.routed_at_sample = routed
+        self.sampled_at = now
+
+    def backlog(self, replica, now):
+        # Estimated current depth: last sampled depth plus what was routed there
+        # since, minus what the replica should have drained in the meantime.
+        depth = self.depths.get(replica, 0) + self.routed[replica] - self.routed_at_sample.get(replica, 0)
+        if self.sampled_at is not None:
+            depth -= self.drain_rates.get(replica, 0) * (now - self.sampled_at)
+        return max(depth, 0)
+
+    def metrics(self):
+        now = time.monotonic()
+        replicas = {}
+        for replica in sorted(set(self.replicas) | set(self.depths)):
+            rate = self.drain_rates.get(replica)
+            depth = self.depths.get(replica, 0)
+            replicas[replica] = {
+                'live': replica in self.replicas,
+                'queue_depth': depth,
+                'consumers': self.consumers.get(replica, 0),
+                'drain_rate': None if rate is None else round(rate, 2),
+                'lag_seconds': None if not rate else round(depth / rate, 3),
+                'estimated_backlog': round(self.backlog(replica, now), 1),
+                'routed': self.routed[replica],
+            }
+        return {
+            'sampled_seconds_ago': None if self.sampled_at is None else round(now - self.sampled_at, 3),
+            'rerouted': self.rerouted,
+            'replicas': replicas,
+        }
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("Could not refresh monitoring replicas, keeping %s: %s", list(self.replicas), e)
+            time.sleep(self.interval)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+def stable_hash(value):
+    # hash() is salted per process; routing must agree across restarts and LB replicas.
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+class Router():
+    def __init__(self, replicas):
+        self.replicas = replicas
+
+    def route(self, message):
+        replica = self.choose(message)
+        self.replicas.routed[replica] += 1
+        return replica
+
+class RoundRobinRouter(Router):
+    def __init__(self, replicas):
+        super().__init__(replicas)
+        self.counter = itertools.count()
+
+    def choose(self, message):
+        live = self.replicas.replicas
+        return live[next(self.counter) % len(live)]
+
+class ConsistentHashRouter(Router):
+    # Hash ring with virtual nodes keyed on data.device_id, so a device sticks to
+    # one replica and only about 1/N of devices move when a replica joins or leaves.
+    def __init__(self, replicas, virtual_nodes=VIRTUAL_NODES, key='device_id'):
+        super().__init__(replicas)
+        self.virtual_nodes = virtual_nodes
+        self.key = key
+        self.ring = (None, [], [])
+        self.fallback = RoundRobinRouter(replicas)
+
+    def build(self, live):
+        nodes = sorted((stable_hash(f"replica{replica}#{node}"), replica) for replica in live for node in range(self.virtual_nodes))
+        self.ring = (live, [point for point, _ in nodes], [replica for _, replica in nodes])
+
+    def choose(self, message):
+        key = (message.get('data') or {}).get(self.key)
+        if key is None:
+            return self.fallback.choose(message)
+        live = self.replicas.replicas
+        if self.ring[0] != live:
+            self.build(live)
+        _, points, owners = self.ring
+        return owners[bisect.bisect(points, stable_hash(str(key))) % len(points)]
+
+class LeastLoadedRouter(Router):
+    # Sends each reading to the replica with the shortest estimated time to
+    # drain its backlog, so a replica stalled on a slow database stops
+    # receiving new readings until it catches up. Readings for one device
+    # may land on different replicas.
+    def __init__(self, replicas):
+        super().__init__(replicas)
+        self.counter = itertools.count()
+
+    def choose(self, message):
+        now = time.monotonic()
+        live = self.replicas.replicas
+        # Rotate the starting point so ties (e.g. before the first sample) spread evenly.
+        start = next(self.counter)
+        best, best_cost = None, None
+        for offset in range(len(live)):
+            replica = live[(start + offset) % len(live)]
+            cost = self.replicas.backlog(replica, now) / max(self.replicas.drain_rates.get(replica, 0), 1.0)
+            if best_cost is None or cost < best_cost:
+                best, best_cost = replica, cost
+        return best
+
+ROUTERS = {
+    'round-robin': RoundRobinRouter,
+    'hash': ConsistentHashRouter,
+    'least-loaded': LeastLoadedRouter,
+}
+
+def make_router(replicas, strategy=ROUTING_STRATEGY):
+    if strategy not in ROUTERS:
+        raise ValueError(f"Unknown routing strategy '{strategy}', expected one of {', '.join(ROUTERS)}")
+    return ROUTERS[strategy](replicas)
@@ -0,0 +1,83 @@
+# Inspect and replay messages parked in a consumer's dead-letter queue.
+#
+#   python dead_letters.py list monitoring-service.monitoring_ingest.replica1.dlq
+#   python dead_letters.py replay monitoring-service.monitoring_ingest.replica1.dlq --limit 10
+#   python dead_letters.py purge monitoring-service.monitoring_ingest.replica1.dlq
+import argparse
+import os
+import pika
+from rabbitmq_client import RabbitMQ
+import message_codecs
+
+RETRY_HEADERS = ('x-retry-count', 'retry-delay', 'x-error', 'x-original-exchange', 'x-original-routing-key', 'x-original-queue')
+
+def list_messages(channel, dlq, limit):
+    count = 0
+    while count < limit:
+        method, properties, body = channel.basic_get(queue=dlq, auto_ack=False)
+        if method is None:
+            break
+        count += 1
+        headers = properties.headers or {}
+        try:
+            message = message_codecs.decode(body, properties.content_type)
+        except ValueError:
+            message = body
+        print(f"#{count} retries={headers.get('x-retry-count', 0)} from={headers.get('x-original-queue')} error={headers.get('x-error')}")
+        print(f"    {message}")
+    # Closing the channel without acking returns everything to the queue.
+    print(f"{count} message(s) shown")
+
+def queue_exists(connection, queue):
+    channel = connection.channel()
+    try:
+        channel.queue_declare(queue=queue, passive=True)
+        channel.close()
+        return True
+    except pika.exceptions.ChannelClosedByBroker:
+        return False
+
+def replay_messages(connection, channel, dlq, limit):
+    count = 0
+    while count < limit:
+        method, properties, body = channel.basic_get(queue=dlq, auto_ack=False)
+        if method is None:
+            break
+        headers = dict(properties.headers or {})
+        original_queue = headers.get('x-original-queue')
+        exchange = headers.get('x-original-exchange', '')
+        routing_key = headers.get('x-original-routing-key', '')
+        # Prefer the consumer's own queue so fanout exchanges don't redeliver to every service.
+        if original_queue and queue_exists(connection, original_queue):
+            exchange, routing_key = '', original_queue
+        for header in RETRY_HEADERS:
+            headers.pop(header, None)
+        channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                              properties=pika.BasicProperties(content_type=properties.content_type, headers=headers, delivery_mode=2))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        count += 1
+        print(f"Replayed message to exchange '{exchange}' with routing_key '{routing_key}'")
+    print(f"{count} message(s) replayed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a dead-letter queue")
+    parser.add_argument('command', choices=['list', 'replay', 'purge'])
+    parser.add_argument('queue')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--host', default=os.environ.get('RABBIT_HOST', 'rabbitmq'))
+    args = parser.parse_args()
+
+    client = RabbitMQ('dead-letter-cli', '', args.host)
+    connection = client.connect_with_retry(client.host, client.port)
+    channel = connection.channel()
+    if args.command == 'list':
+        list_messages(channel, args.queue, args.limit)
+    elif args.command == 'replay':
+        replay_messages(connection, channel, args.queue, args.limit)
+    else:
+        result = channel.queue_purge(queue=args.queue)
+        print(f"Purged {result.method.message_count} message(s) from {args.queue}")
+    connection.close()
+
+if __name__ == '__main__':
+    main()
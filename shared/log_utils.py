@@ -0,0 +1,89 @@
+import logging
+import logging.handlers
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import threading
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+
+# Pass as extra= on per-message log calls; only LOG_SAMPLE_RATE of them are kept.
+SAMPLED = {'sampled': True}
+
+_configured = False
+_configure_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    # Drops most records marked as sampled before they are queued, so a chatty
+    # per-delivery log costs one random() call instead of a write to stdout.
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False):
+            return random.random() < self.rate
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The stock QueueHandler runs the full formatter in the calling thread. Only
+    # merge the args here (they may be mutated after the call returns) and leave
+    # timestamps, JSON encoding and the stdout write to the listener thread.
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configure():
+    """Route all logging through a queue drained by a background thread writing to stdout."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == 'json':
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+        records = queue.SimpleQueue()
+        handler = _QueueHandler(records)
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+        listener = logging.handlers.QueueListener(records, stream)
+        listener.start()
+        atexit.register(listener.stop)
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(LOG_LEVEL)
+        _configured = True
+
+def get_logger(name):
+    configure()
+    return logging.getLogger(name)
@@ -0,0 +1,546 @@
+# In-memory stand-in for RabbitMQ, selected with the RABBIT_BROKER env var:
+#
+#   RABBIT_BROKER=memory                    one broker per host name, inside this process
+#   RABBIT_BROKER=memory://127.0.0.1:5673   shared broker served by `python memory_broker.py --port 5673`
+#
+# It implements the parts of AMQP 0-9-1 that shared/rabbitmq_client.py relies on:
+# direct/fanout/topic/headers exchanges, the default exchange, exclusive and
+# durable queues, prefetch, acks/nacks with requeue, per-queue message TTL,
+# max-length and dead-lettering. Connections and channels mimic pika's
+# BlockingConnection/BlockingChannel so the client code runs unchanged.
+import argparse
+import collections
+import itertools
+import os
+import threading
+import time
+import uuid
+from multiprocessing.managers import BaseManager
+from types import SimpleNamespace
+import pika
+
+POLL_INTERVAL = 0.005
+EXPIRY_INTERVAL = 0.01
+
+def not_found(text):
+    return pika.exceptions.ChannelClosedByBroker(404, f"NOT_FOUND - {text}")
+
+def precondition_failed(text):
+    return pika.exceptions.ChannelClosedByBroker(406, f"PRECONDITION_FAILED - {text}")
+
+def topic_match(pattern, routing_key):
+    def match(words, keys):
+        if not words:
+            return not keys
+        if words[0] == '#':
+            return any(match(words[1:], keys[i:]) for i in range(len(keys) + 1))
+        if not keys:
+            return False
+        return (words[0] == '*' or words[0] == keys[0]) and match(words[1:], keys[1:])
+    return match(pattern.split('.'), routing_key.split('.'))
+
+def headers_match(arguments, headers):
+    arguments = arguments or {}
+    headers = headers or {}
+    expected = {key: value for key, value in arguments.items() if not key.startswith('x-')}
+    matches = [key in headers and headers[key] == value for key, value in expected.items()]
+    if arguments.get('x-match', 'all') == 'any':
+        return any(matches)
+    return all(matches)
+
+class MemoryQueue():
+    def __init__(self, name, durable, owner, arguments):
+        self.name = name
+        self.durable = durable
+        self.owner = owner
+        self.arguments = arguments or {}
+        # (exchange, routing_key, body, properties, redelivered, expires_at)
+        self.messages = collections.deque()
+        self.unacked = {}
+        self.consumers = collections.Counter()
+        self.published = 0
+        self.acked = 0
+
+class Broker():
+    def __init__(self, name='memory'):
+        self.name = name
+        self.lock = threading.Condition()
+        self.exchanges = {'': 'direct'}
+        self.bindings = collections.defaultdict(list)
+        self.queues = {}
+        self.delivery_ids = itertools.count(1)
+        threading.Thread(target=self.expire_loop, daemon=True).start()
+
+    def declare_exchange(self, exchange, exchange_type='direct', passive=False):
+        with self.lock:
+            existing = self.exchanges.get(exchange)
+            if passive:
+                if existing is None:
+                    raise not_found(f"no exchange '{exchange}'")
+                return existing
+            if existing is not None and existing != exchange_type:
+                raise precondition_failed(f"inequivalent arg 'type' for exchange '{exchange}': received '{exchange_type}' but current is '{existing}'")
+            self.exchanges[exchange] = exchange_type
+            return exchange_type
+
+    def delete_exchange(self, exchange):
+        with self.lock:
+            self.exchanges.pop(exchange, None)
+            self.bindings.pop(exchange, None)
+
+    def declare_queue(self, queue='', connection_id=None, passive=False, durable=False, exclusive=False, arguments=None):
+        with self.lock:
+            if passive:
+                if queue not in self.queues:
+                    raise not_found(f"no queue '{queue}'")
+            else:
+                queue = queue or f"amq.gen-{uuid.uuid4().hex}"
+                existing = self.queues.get(queue)
+                if existing is None:
+                    self.queues[queue] = MemoryQueue(queue, durable, connection_id if exclusive else None, arguments)
+                elif (existing.arguments or {}) != (arguments or {}):
+                    raise precondition_failed(f"inequivalent arguments for queue '{queue}'")
+                elif existing.owner is not None and existing.owner != connection_id:
+                    raise pika.exceptions.ChannelClosedByBroker(405, f"RESOURCE_LOCKED - cannot obtain exclusive access to locked queue '{queue}'")
+            state = self.queues[queue]
+            return queue, len(state.messages), sum(state.consumers.values())
+
+    def delete_queue(self, queue):
+        with self.lock:
+            state = self.queues.pop(queue, None)
+            for bindings in self.bindings.values():
+                bindings[:] = [binding for binding in bindings if binding[0] != queue]
+            return len(state.messages) if state else 0
+
+    def purge_queue(self, queue):
+        with self.lock:
+            state = self.get_queue(queue)
+            count = len(state.messages)
+            state.messages.clear()
+            return count
+
+    def bind_queue(self, exchange, queue, routing_key='', arguments=None):
+        with self.lock:
+            if exchange not in self.exchanges:
+                raise not_found(f"no exchange '{exchange}'")
+            self.get_queue(queue)
+            binding = (queue, routing_key or '', dict(arguments or {}))
+            if binding not in self.bindings[exchange]:
+                self.bindings[exchange].append(binding)
+
+    def unbind_queue(self, exchange, queue, routing_key='', arguments=None):
+        with self.lock:
+            binding = (queue, routing_key or '', dict(arguments or {}))
+            if binding in self.bindings[exchange]:
+                self.bindings[exchange].remove(binding)
+
+    def get_queue(self, queue):
+        state = self.queues.get(queue)
+        if state is None:
+            raise not_found(f"no queue '{queue}'")
+        return state
+
+    def route(self, exchange, routing_key, properties):
+        if exchange == '':
+            return [routing_key] if routing_key in self.queues else []
+        exchange_type = self.exchanges.get(exchange)
+        if exchange_type is None:
+            raise not_found(f"no exchange '{exchange}'")
+        headers = getattr(properties, 'headers', None)
+        queues = []
+        for queue, key, arguments in self.bindings[exchange]:
+            if exchange_type == 'fanout':
+                matched = True
+            elif exchange_type == 'direct':
+                matched = key == routing_key
+            elif exchange_type == 'topic':
+                matched = topic_match(key, routing_key)
+            else:
+                matched = headers_match(arguments, headers)
+            if matched and queue not in queues:
+                queues.append(queue)
+        return queues
+
+    def enqueue(self, state, exchange, routing_key, body, properties, redelivered=False):
+        ttl = state.arguments.get('x-message-ttl')
+        expires_at = time.monotonic() + ttl / 1000.0 if ttl is not None else None
+        state.messages.append((exchange, routing_key, body, properties, redelivered, expires_at))
+        state.published += 1
+        max_length = state.arguments.get('x-max-length')
+        while max_length is not None and len(state.messages) > max_length:
+            self.dead_letter(state, state.messages.popleft())
+
+    def dead_letter(self, state, message):
+        exchange = state.arguments.get('x-dead-letter-exchange')
+        if exchange is None or (exchange != '' and exchange not in self.exchanges):
+            return
+        _, routing_key, body, properties, _, _ = message
+        routing_key = state.arguments.get('x-dead-letter-routing-key', routing_key)
+        for queue in self.route(exchange, routing_key, properties):
+            self.enqueue(self.queues[queue], exchange, routing_key, body, properties)
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        with self.lock:
+            queues = self.route(exchange, routing_key, properties)
+            for queue in queues:
+                self.enqueue(self.queues[queue], exchange, routing_key, body, properties)
+            if queues:
+                self.lock.notify_all()
+            return len(queues)
+
+    def get(self, queue, connection_id, timeout=0):
+        # Returns one delivery, or None. A blocking call returns early (with
+        # None) on any broker activity so callers can run their own callbacks.
+        with self.lock:
+            state = self.get_queue(queue)
+            if not state.messages and timeout:
+                self.lock.wait(timeout)
+                state = self.get_queue(queue)
+            if not state.messages:
+                return None
+            message = state.messages.popleft()
+            delivery_id = next(self.delivery_ids)
+            state.unacked[delivery_id] = (message, connection_id)
+            exchange, routing_key, body, properties, redelivered, _ = message
+            return delivery_id, exchange, routing_key, body, properties, redelivered, len(state.messages)
+
+    def ack(self, queue, delivery_id):
+        with self.lock:
+            state = self.queues.get(queue)
+            if state is not None and state.unacked.pop(delivery_id, None) is not None:
+                state.acked += 1
+
+    def reject(self, queue, delivery_id, requeue=True):
+        with self.lock:
+            state = self.queues.get(queue)
+            if state is None:
+                return
+            entry = state.unacked.pop(delivery_id, None)
+            if entry is None:
+                return
+            message = entry[0]
+            if requeue:
+                exchange, routing_key, body, properties, _, expires_at = message
+                state.messages.appendleft((exchange, routing_key, body, properties, True, expires_at))
+                self.lock.notify_all()
+            else:
+                self.dead_letter(state, message)
+
+    def add_consumer(self, queue, connection_id):
+        with self.lock:
+            self.get_queue(queue).consumers[connection_id] += 1
+
+    def remove_consumer(self, queue, connection_id):
+        with self.lock:
+            state = self.queues.get(queue)
+            if state is not None and state.consumers[connection_id] > 0:
+                state.consumers[connection_id] -= 1
+
+    def close_connection(self, connection_id):
+        # Like a dropped AMQP connection: unacked deliveries go back to their
+        # queues and the connection's exclusive queues disappear.
+        with self.lock:
+            for state in list(self.queues.values()):
+                returned = sorted(delivery_id for delivery_id, (_, owner) in state.unacked.items() if owner == connection_id)
+                for delivery_id in reversed(returned):
+                    exchange, routing_key, body, properties, _, expires_at = state.unacked.pop(delivery_id)[0]
+                    state.messages.appendleft((exchange, routing_key, body, properties, True, expires_at))
+                state.consumers.pop(connection_id, None)
+                if state.owner == connection_id:
+                    self.delete_queue(state.name)
+            self.lock.notify_all()
+
+    def wake(self):
+        with self.lock:
+            self.lock.notify_all()
+
+    def stats(self):
+        with self.lock:
+            return {name: {
+                'messages': len(state.messages),
+                'unacked': len(state.unacked),
+                'consumers': sum(state.consumers.values()),
+                'published': state.published,
+                'acked': state.acked
+            } for name, state in self.queues.items()}
+
+    def expire_loop(self):
+        while True:
+            time.sleep(EXPIRY_INTERVAL)
+            now = time.monotonic()
+            with self.lock:
+                expired = False
+                for state in list(self.queues.values()):
+                    while state.messages and state.messages[0][5] is not None and state.messages[0][5] <= now:
+                        self.dead_letter(state, state.messages.popleft())
+                        expired = True
+                if expired:
+                    self.lock.notify_all()
+
+class MemoryChannel():
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = channel_number
+        self.is_open = True
+        self.prefetch = 0
+        self.consumers = {}
+        self.unacked = collections.OrderedDict()
+        self.delivery_tags = itertools.count(1)
+        self.consumer_tags = itertools.count(1)
+        self.consuming = False
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def call(self, method, *args, **kwargs):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError('Channel is closed.')
+        try:
+            return getattr(self.broker, method)(*args, **kwargs)
+        except pika.exceptions.ChannelClosedByBroker:
+            self.close()
+            raise
+
+    def exchange_declare(self, exchange, exchange_type='direct', passive=False, durable=False, auto_delete=False, internal=False, arguments=None):
+        self.call('declare_exchange', exchange, exchange_type, passive)
+        return SimpleNamespace(method=SimpleNamespace())
+
+    def exchange_delete(self, exchange=None, if_unused=False):
+        self.call('delete_exchange', exchange)
+
+    def queue_declare(self, queue='', passive=False, durable=False, exclusive=False, auto_delete=False, arguments=None):
+        name, message_count, consumer_count = self.call('declare_queue', queue, self.connection.id, passive, durable, exclusive, arguments)
+        return SimpleNamespace(method=SimpleNamespace(queue=name, message_count=message_count, consumer_count=consumer_count))
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        return SimpleNamespace(method=SimpleNamespace(message_count=self.call('delete_queue', queue)))
+
+    def queue_purge(self, queue):
+        return SimpleNamespace(method=SimpleNamespace(message_count=self.call('purge_queue', queue)))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self.call('bind_queue', exchange, queue, routing_key, arguments)
+
+    def queue_unbind(self, queue, exchange=None, routing_key=None, arguments=None):
+        self.call('unbind_queue', exchange, queue, routing_key, arguments)
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, global_qos=False):
+        self.prefetch = prefetch_count
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        routed = self.call('publish', exchange, routing_key, body, properties)
+        if mandatory and not routed:
+            raise pika.exceptions.UnroutableError([])
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False, consumer_tag=None, arguments=None):
+        self.call('add_consumer', queue, self.connection.id)
+        consumer_tag = consumer_tag or f"ctag{self.channel_number}.{next(self.consumer_tags)}"
+        self.consumers[consumer_tag] = (queue, on_message_callback, auto_ack)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        queue, _, _ = self.consumers.pop(consumer_tag)
+        self.broker.remove_consumer(queue, self.connection.id)
+
+    def start_consuming(self):
+        self.consuming = True
+        while self.consuming and self.consumers and self.is_open:
+            self.connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self, consumer_tag=None):
+        self.consuming = False
+
+    def track(self, queue, delivery):
+        delivery_id, exchange, routing_key, body, properties, redelivered, message_count = delivery
+        delivery_tag = next(self.delivery_tags)
+        method = SimpleNamespace(delivery_tag=delivery_tag, exchange=exchange, routing_key=routing_key, redelivered=redelivered, message_count=message_count)
+        return delivery_tag, method, properties or pika.BasicProperties(), body
+
+    def basic_get(self, queue, auto_ack=False):
+        delivery = self.call('get', queue, self.connection.id)
+        if delivery is None:
+            return None, None, None
+        delivery_tag, method, properties, body = self.track(queue, delivery)
+        if auto_ack:
+            self.broker.ack(queue, delivery[0])
+        else:
+            self.unacked[delivery_tag] = (queue, delivery[0])
+        return method, properties, body
+
+    def deliver(self, timeout=0):
+        delivered = 0
+        for consumer_tag, (queue, callback, auto_ack) in list(self.consumers.items()):
+            limit = self.prefetch or 100
+            while self.is_open and len(self.unacked) < limit:
+                delivery = self.call('get', queue, self.connection.id, timeout if not delivered else 0)
+                if delivery is None:
+                    break
+                delivery_tag, method, properties, body = self.track(queue, delivery)
+                method.consumer_tag = consumer_tag
+                if auto_ack:
+                    self.broker.ack(queue, delivery[0])
+                else:
+                    self.unacked[delivery_tag] = (queue, delivery[0])
+                delivered += 1
+                callback(self, method, properties, body)
+        return delivered
+
+    def settled_tags(self, delivery_tag, multiple):
+        if multiple:
+            tags = [tag for tag in self.unacked if tag <= delivery_tag or delivery_tag == 0]
+        else:
+            tags = [delivery_tag]
+        for tag in tags:
+            if tag not in self.unacked:
+                self.close()
+                raise pika.exceptions.ChannelClosedByBroker(406, f"PRECONDITION_FAILED - unknown delivery tag {tag}")
+        return tags
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        for tag in self.settled_tags(delivery_tag, multiple):
+            queue, delivery_id = self.unacked.pop(tag)
+            self.broker.ack(queue, delivery_id)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        for tag in self.settled_tags(delivery_tag, multiple):
+            queue, delivery_id = self.unacked.pop(tag)
+            self.broker.reject(queue, delivery_id, requeue)
+
+    def basic_reject(self, delivery_tag=0, requeue=True):
+        self.basic_nack(delivery_tag, False, requeue)
+
+    def close(self, reply_code=0, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+        self.is_open = False
+        for queue, delivery_id in reversed(list(self.unacked.values())):
+            self.broker.reject(queue, delivery_id, True)
+        self.unacked.clear()
+        for queue, _, _ in self.consumers.values():
+            self.broker.remove_consumer(queue, self.connection.id)
+        self.consumers.clear()
+
+class MemoryConnection():
+    def __init__(self, broker):
+        self.broker = broker
+        self.id = uuid.uuid4().hex
+        self.is_open = True
+        self.channels = []
+        self.channel_numbers = itertools.count(1)
+        self.callbacks = collections.deque()
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self, channel_number=None):
+        if not self.is_open:
+            raise pika.exceptions.ConnectionWrongStateError('Connection is closed.')
+        channel = MemoryChannel(self, channel_number or next(self.channel_numbers))
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        if not self.is_open:
+            raise pika.exceptions.ConnectionWrongStateError('Connection is closed.')
+        self.callbacks.append(callback)
+        self.broker.wake()
+
+    def process_data_events(self, time_limit=0):
+        if not self.is_open:
+            raise pika.exceptions.ConnectionWrongStateError('Connection is closed.')
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        while True:
+            handled = 0
+            while self.callbacks:
+                self.callbacks.popleft()()
+                handled += 1
+            consuming = [channel for channel in self.channels if channel.is_open and channel.consumers]
+            for channel in consuming:
+                handled += channel.deliver()
+            if handled:
+                return
+            remaining = POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, deadline - time.monotonic())
+            if remaining <= 0:
+                return
+            if consuming:
+                if consuming[0].deliver(timeout=remaining):
+                    return
+            else:
+                time.sleep(remaining)
+
+    def sleep(self, duration):
+        self.process_data_events(time_limit=duration)
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        if not self.is_open:
+            return
+        for channel in self.channels:
+            channel.close()
+        self.is_open = False
+        self.broker.close_connection(self.id)
+
+class BrokerManager(BaseManager):
+    pass
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+_managers = {}
+
+def local_broker(name):
+    with _brokers_lock:
+        if name not in _brokers:
+            _brokers[name] = Broker(name)
+        return _brokers[name]
+
+def authkey():
+    return os.environ.get('RABBIT_PASS', 'admin123').encode('utf-8')
+
+def remote_broker(address, name):
+    # Proxies are cached: creating one costs several fresh authenticated
+    # socket connections to the manager, far more than a broker call.
+    with _brokers_lock:
+        proxy = _brokers.get((address, name))
+        if proxy is not None:
+            return proxy
+        manager = _managers.get(address)
+        if manager is None:
+            host, port = address.rsplit(':', 1)
+            manager = BrokerManager(address=(host, int(port)), authkey=authkey())
+            try:
+                manager.connect()
+            except OSError as e:
+                raise pika.exceptions.AMQPConnectionError(f"Memory broker at {address} unreachable: {e}")
+            _managers[address] = manager
+        proxy = _brokers[(address, name)] = manager.broker(name)
+        return proxy
+
+def connect(url, host):
+    # Each host name gets its own broker, so services still see
+    # rabbitmq-service and collection-rabbitmq-service as separate brokers.
+    if url == 'memory':
+        return MemoryConnection(local_broker(host))
+    return MemoryConnection(remote_broker(url[len('memory://'):], host))
+
+BrokerManager.register('broker', callable=local_broker)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve in-memory brokers to local processes")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5673)
+    args = parser.parse_args()
+
+    manager = BrokerManager(address=(args.host, args.port), authkey=authkey())
+    server = manager.get_server()
+    print(f"Memory broker listening on {args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+class Codec():
+    def __init__(self, name, content_type, encode, decode):
+        self.name = name
+        self.content_type = content_type
+        self.encode = encode
+        self.decode = decode
+
+def json_encode(message):
+    return json.dumps(message).encode('utf-8')
+
+def orjson_encode(message):
+    return orjson.dumps(message)
+
+def json_decode(body):
+    # orjson reads the same wire format, so use it for decoding whenever it is installed.
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def msgpack_encode(message):
+    return msgpack.packb(message, use_bin_type=True)
+
+def msgpack_decode(body):
+    return msgpack.unpackb(body, raw=False)
+
+def get_codec(name):
+    if name == 'json':
+        return Codec('json', JSON, json_encode, json_decode)
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError("Codec 'orjson' requested but the orjson package is not installed")
+        return Codec('orjson', JSON, orjson_encode, json_decode)
+    if name == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError("Codec 'msgpack' requested but the msgpack package is not installed")
+        return Codec('msgpack', MSGPACK, msgpack_encode, msgpack_decode)
+    raise ValueError(f"Unknown message codec: {name}")
+
+def decode(body, content_type=None):
+    # Messages published before codecs existed carry no content_type and are JSON.
+    try:
+        if content_type == MSGPACK:
+            if msgpack is None:
+                raise ValueError("Received a msgpack message but the msgpack package is not installed")
+            return msgpack_decode(body)
+        return json_decode(body)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Could not decode {content_type or JSON} message: {e}")
@@ -1,14 +1,308 @@
-from flask import Flask
 import pika
 import threading
 import time
 import os
-import sys
-import json
+import queue
+import signal
+import inspect
+import atexit
+import random
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+import message_codecs
+import memory_broker
+import log_utils
+
+PUBLISHER_POOL = os.environ.get('RABBIT_PUBLISHER_POOL', 'true').lower() in ('1', 'true', 'yes')
+PUBLISH_BUFFER_SIZE = int(os.environ.get('RABBIT_PUBLISH_BUFFER', 10000))
+PUBLISH_BATCH_SIZE = int(os.environ.get('RABBIT_PUBLISH_BATCH', 100))
+PUBLISH_BLOCK_TIMEOUT = float(os.environ.get('RABBIT_PUBLISH_BLOCK_TIMEOUT', 5))
+SHUTDOWN_FLUSH_TIMEOUT = float(os.environ.get('RABBIT_SHUTDOWN_FLUSH_TIMEOUT', 5))
+CONSUMER_PREFETCH = int(os.environ.get('RABBIT_PREFETCH', 20))
+CONSUMER_WORKERS = int(os.environ.get('RABBIT_CONSUMER_WORKERS', 1))
+MESSAGE_CODEC = os.environ.get('RABBIT_CODEC', 'json')
+MAX_RETRIES = int(os.environ.get('RABBIT_MAX_RETRIES', 5))
+RETRY_DELAY_MS = int(os.environ.get('RABBIT_RETRY_DELAY_MS', 1000))
+QUEUE_TTL_MS = int(os.environ.get('RABBIT_QUEUE_TTL_MS', 0))
+QUEUE_MAX_LENGTH = int(os.environ.get('RABBIT_QUEUE_MAX_LENGTH', 0))
+RECONNECT_BASE_DELAY = float(os.environ.get('RABBIT_RECONNECT_BASE_DELAY', 0.5))
+RECONNECT_MAX_DELAY = float(os.environ.get('RABBIT_RECONNECT_MAX_DELAY', 30))
+PUBLISH_TIMEOUT = float(os.environ.get('RABBIT_PUBLISH_TIMEOUT', 5))
+BROKER = os.environ.get('RABBIT_BROKER', 'amqp')
+
+log = log_utils.get_logger('rabbitmq')
+# pika logs every connection and channel open at INFO.
+logging.getLogger('pika').setLevel(logging.WARNING)
+
+_async_publishers = []
+
+def _exit_on_sigterm(signum, frame):
+    # SIGTERM (pod stop, kill, timeout) skips atexit. Flush buffered publishes
+    # first, then exit through SystemExit so the other atexit hooks still run.
+    for publisher in list(_async_publishers):
+        publisher.shutdown()
+    raise SystemExit(128 + signum)
+
+def install_sigterm_handler():
+    # Signal handlers can only be set from the main thread; a handler the
+    # process already installed is left alone.
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+class BrokerUnavailable(pika.exceptions.AMQPConnectionError):
+    pass
+
+class Backoff():
+    # Exponential backoff with full jitter, so pods that lose the broker at the
+    # same moment spread their reconnect attempts instead of retrying in lockstep.
+    def __init__(self, base=RECONNECT_BASE_DELAY, maximum=RECONNECT_MAX_DELAY):
+        self.base = base
+        self.maximum = maximum
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = random.uniform(0, min(self.maximum, self.base * 2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+class PublisherConnection():
+    # One long-lived publishing connection per broker per process. pika's
+    # BlockingConnection is not thread-safe, so every publish goes through
+    # self.lock and reuses the same channel instead of opening a new
+    # connection and channel for each message.
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.lock = threading.Lock()
+        self.connection = None
+        self.channel = None
+        self.declared = set()
+        self.backoff = Backoff()
+        self.retry_at = 0
+
+    @classmethod
+    def get(cls, key, connect):
+        with cls._instances_lock:
+            publisher = cls._instances.get(key)
+            if publisher is None:
+                publisher = cls._instances[key] = cls(connect)
+            return publisher
+
+    def acquire_channel(self):
+        if self.connection is None or self.connection.is_closed:
+            self.reset()
+            # While the broker is known to be down, fail immediately instead of
+            # making every caller wait out its own connection timeout.
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                raise BrokerUnavailable(f"Broker unavailable, next reconnect attempt in {wait:.1f}s")
+            try:
+                self.connection = self.connect()
+            except pika.exceptions.AMQPConnectionError:
+                self.retry_at = time.monotonic() + self.backoff.next_delay()
+                raise
+            self.backoff.reset()
+        if self.channel is None or self.channel.is_closed:
+            self.channel = self.connection.channel()
+            self.declared = set()
+        return self.channel
+
+    def reset(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+        self.channel = None
+        self.declared = set()
+
+    def publish(self, exchange, exchange_type, routing_key, body, properties=None):
+        if not self.lock.acquire(timeout=PUBLISH_TIMEOUT):
+            raise BrokerUnavailable(f"Timed out after {PUBLISH_TIMEOUT}s waiting for the publisher connection")
+        try:
+            for attempt in range(2):
+                try:
+                    channel = self.acquire_channel()
+                    if (exchange, exchange_type) not in self.declared:
+                        channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+                        self.declared.add((exchange, exchange_type))
+                    channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+                    return
+                except pika.exceptions.AMQPChannelError:
+                    self.channel = None
+                    raise
+                except BrokerUnavailable:
+                    raise
+                except pika.exceptions.AMQPConnectionError as e:
+                    # Stale connection (broker restart, missed heartbeats): reconnect once and retry.
+                    log.warning("Publisher connection lost, reconnecting: %s", e)
+                    self.reset()
+                    if attempt:
+                        raise
+        finally:
+            self.lock.release()
+
+    def call(self, operation):
+        # Runs operation(channel) on the shared channel, e.g. a basic_get, so
+        # short broker operations need no connection of their own.
+        if not self.lock.acquire(timeout=PUBLISH_TIMEOUT):
+            raise BrokerUnavailable(f"Timed out after {PUBLISH_TIMEOUT}s waiting for the publisher connection")
+        try:
+            return operation(self.acquire_channel())
+        except pika.exceptions.AMQPChannelError:
+            self.channel = None
+            raise
+        except pika.exceptions.AMQPConnectionError:
+            self.reset()
+            raise
+        finally:
+            self.lock.release()
+
+    def close(self):
+        with self.lock:
+            self.reset()
+
+class AsyncPublisher():
+    # Background publisher for one exchange. Callers enqueue into a bounded
+    # buffer and get a Future; a single thread owns the connection, drains the
+    # buffer in batches and resolves each Future once the broker confirms it.
+    def __init__(self, connect, exchange, exchange_type, buffer_size=PUBLISH_BUFFER_SIZE, batch_size=PUBLISH_BATCH_SIZE):
+        self.connect = connect
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.batch_size = batch_size
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.connection = None
+        self.channel = None
+        self.backoff = Backoff()
+        threading.Thread(target=self.run, daemon=True).start()
+        _async_publishers.append(self)
+        atexit.register(self.shutdown)
+
+    def submit(self, routing_key, body, properties=None, timeout=PUBLISH_BLOCK_TIMEOUT):
+        future = Future()
+        try:
+            # Blocks the caller while the buffer is full instead of growing without bound.
+            self.buffer.put((routing_key, body, properties, future), timeout=timeout)
+        except queue.Full:
+            raise queue.Full(f"Publish buffer for exchange {self.exchange} is full ({self.buffer.maxsize} messages)")
+        future.add_done_callback(self.report_failure)
+        return future
+
+    def report_failure(self, future):
+        # Callers get the Future but rarely wait on it; a rejected publish must
+        # still show up somewhere.
+        error = future.exception()
+        if error is not None:
+            log.error("Async publish to exchange %s failed: %r", self.exchange, error)
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.buffer.all_tasks_done:
+            while self.buffer.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.buffer.all_tasks_done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=SHUTDOWN_FLUSH_TIMEOUT):
+        if not self.flush(timeout):
+            log.error("Exiting with %d messages for exchange %s still unpublished after %ss", self.buffer.unfinished_tasks, self.exchange, timeout)
+
+    def open_channel(self):
+        self.connection = self.connect()
+        self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+        self.channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
+
+    def reset(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+        self.channel = None
+
+    def next_batch(self):
+        try:
+            batch = [self.buffer.get(timeout=1)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        batch = []
+        while True:
+            if not batch:
+                batch = self.next_batch()
+            try:
+                if not batch:
+                    # Idle: keep heartbeats flowing on the open connection.
+                    if self.connection is not None and self.connection.is_open:
+                        self.connection.process_data_events(0)
+                    continue
+                if self.channel is None or self.channel.is_closed:
+                    self.open_channel()
+                    self.backoff.reset()
+                while batch:
+                    routing_key, body, properties, future = batch[0]
+                    try:
+                        self.channel.basic_publish(exchange=self.exchange, routing_key=routing_key, body=body, properties=properties)
+                        future.set_result(True)
+                    except pika.exceptions.NackError as e:
+                        log.error("Broker rejected message for exchange %s: %s", self.exchange, e)
+                        future.set_exception(e)
+                    batch.pop(0)
+                    self.buffer.task_done()
+            except pika.exceptions.AMQPError as e:
+                # Unconfirmed messages stay in the batch and are republished after reconnecting.
+                delay = self.backoff.next_delay()
+                log.warning("Async publisher for %s lost its connection, retrying %d messages in %.1fs: %s", self.exchange, len(batch), delay, e)
+                self.reset()
+                time.sleep(delay)
+
+class WorkerPool():
+    # Runs message handlers off the pika I/O thread. With an ordering key,
+    # messages sharing the same data[ordering_key] always land on the same
+    # single-worker lane, so they are handled in delivery order.
+    #
+    # kind='process' runs handlers in child processes. Only module-level
+    # functions can be sent there, and whatever module state they update
+    # (caches, counters) stays in the child, so it is for stateless handlers
+    # only; every service handler uses the default thread pool.
+    def __init__(self, workers, kind='thread', ordering_key=None):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown worker pool '{kind}', expected 'thread' or 'process'")
+        executor_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        self.ordering_key = ordering_key
+        if ordering_key:
+            self.lanes = [executor_class(max_workers=1) for _ in range(workers)]
+        else:
+            self.lanes = [executor_class(max_workers=workers)]
+
+    def submit(self, handler, message):
+        lane = 0
+        if self.ordering_key:
+            key = (message.get('data') or {}).get(self.ordering_key)
+            lane = hash(str(key)) % len(self.lanes)
+        return self.lanes[lane].submit(handler, message)
 
 class RabbitMQ():
 
-    def __init__(self, consumerName, exchangeName, host=None, exchange_type='fanout', routing_key=''):
+    def __init__(self, consumerName, exchangeName, host=None, exchange_type='fanout', routing_key='', codec=None, group=None, queue_ttl_ms=QUEUE_TTL_MS, queue_max_length=QUEUE_MAX_LENGTH):
         self.host = host or os.environ.get('RABBIT_HOST', 'rabbitmq')
         self.port = int(os.environ.get('RABBIT_PORT', 5672))
         self.username = os.environ.get('RABBIT_USER', 'admin')
@@ -17,67 +311,285 @@ class RabbitMQ():
         self.exchange = exchangeName
         self.exchange_type = exchange_type
         self.routing_key = routing_key
+        self.codec = message_codecs.get_codec(codec or MESSAGE_CODEC)
+        # With a group, consumers declare a durable named queue shared by every
+        # consumer in that group instead of a private exclusive one.
+        self.group = group
+        self.queue_ttl_ms = queue_ttl_ms
+        self.queue_max_length = queue_max_length
+        self.async_publisher = None
+        self.async_publisher_lock = threading.Lock()
+
+    def consumeMessage(self, message_handler=None, prefetch=CONSUMER_PREFETCH, workers=CONSUMER_WORKERS, ordering_key=None, pool='thread'):
+        if pool == 'process' and not (inspect.isfunction(message_handler) and '<' not in message_handler.__qualname__):
+            raise ValueError(f"pool='process' needs a stateless module-level handler function, got {message_handler!r}")
+        worker_pool = WorkerPool(workers, pool, ordering_key) if message_handler and workers > 1 else None
+        bound_queue = []
+
+        def settle(ch, delivery_tag, properties, body, error):
+            if error is not None:
+                log.error("%s error processing message: %s", self.consumer, error)
+                self.retry_or_dead_letter(ch, bound_queue[0], properties, body, error)
+            ch.basic_ack(delivery_tag=delivery_tag)
 
-    def consumeMessage(self, message_handler=None):
         def callback(ch, method, properties, body):
             try:
-                message = json.loads(body)
-                print(f"{self.consumer} received: {message}", flush=True)
-                if message_handler:
-                    message_handler(message)
+                message = message_codecs.decode(body, properties.content_type)
+            except ValueError:
+                log.warning("%s received undecodable message: %r", self.consumer, body)
                 ch.basic_ack(delivery_tag=method.delivery_tag)
-            except json.JSONDecodeError:
-                print(f"{self.consumer} received invalid JSON: {body}", flush=True)
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-            except Exception as e:
-                print(f"{self.consumer} error processing message: {str(e)}", flush=True)
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                return
+            log.info("%s received: %s", self.consumer, message, extra=log_utils.SAMPLED)
+
+            if worker_pool is None:
+                try:
+                    if message_handler:
+                        message_handler(message)
+                    settle(ch, method.delivery_tag, properties, body, None)
+                except Exception as e:
+                    settle(ch, method.delivery_tag, properties, body, e)
+                return
 
-        def consume():
+            # Acks must be issued from the connection's own thread.
+            def done(future, delivery_tag=method.delivery_tag):
+                try:
+                    ch.connection.add_callback_threadsafe(lambda: settle(ch, delivery_tag, properties, body, future.exception()))
+                except Exception as e:
+                    log.error("%s could not settle delivery %s: %s", self.consumer, delivery_tag, e)
+            worker_pool.submit(message_handler, message).add_done_callback(done)
+
+        def consume(backoff):
             connection = self.connect_with_retry(self.host, self.port)
-            print(f"Connected to RabbitMQ at {self.host}:{self.port}", flush=True)
+            log.info("Connected to RabbitMQ at %s:%s", self.host, self.port)
+            try:
+                channel = connection.channel()
+                if prefetch:
+                    channel.basic_qos(prefetch_count=prefetch)
+                queue_name = self.bind_queue(channel)
+                bound_queue[:] = [queue_name]
+
+                channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
+                backoff.reset()
+                channel.start_consuming()
+            finally:
+                self.close_connection(connection)
+        threading.Thread(target=self.run_with_recovery, args=(consume,), daemon=True).start()
+
+    def consumeBatch(self, batch_handler, max_batch=100, max_wait_ms=200):
+        # batch_handler receives a list of decoded messages and may return the
+        # positions of the ones it failed to process; only those go through
+        # retry/dead-lettering and the whole batch is then acked with a single
+        # multiple=True ack.
+        def handle(channel, queue_name, batch):
+            messages = []
+            decoded = []
+            for delivery in batch:
+                delivery_tag, properties, body = delivery
+                try:
+                    messages.append(message_codecs.decode(body, properties.content_type))
+                    decoded.append(delivery)
+                except ValueError:
+                    log.warning("%s received undecodable message: %r", self.consumer, body)
+
+            failed = []
+            if messages:
+                try:
+                    failed = [(decoded[i], None) for i in batch_handler(messages) or []]
+                except Exception as e:
+                    log.error("%s error processing batch of %d: %s", self.consumer, len(messages), e)
+                    failed = [(delivery, e) for delivery in decoded]
+
+            for (delivery_tag, properties, body), error in failed:
+                self.retry_or_dead_letter(channel, queue_name, properties, body, error or 'failed in batch handler')
+            channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+            log.info("%s processed batch of %d (%d failed)", self.consumer, len(batch), len(failed), extra=log_utils.SAMPLED)
+
+        def consume(backoff):
+            connection = self.connect_with_retry(self.host, self.port)
+            log.info("Connected to RabbitMQ at %s:%s", self.host, self.port)
+            try:
+                channel = connection.channel()
+                channel.basic_qos(prefetch_count=max_batch)
+                queue_name = self.bind_queue(channel)
+
+                pending = []
+                channel.basic_consume(queue=queue_name, on_message_callback=lambda ch, method, properties, body: pending.append((method.delivery_tag, properties, body)), auto_ack=False)
+                backoff.reset()
+                while True:
+                    connection.process_data_events(time_limit=None)
+                    if not pending:
+                        continue
+                    deadline = time.monotonic() + max_wait_ms / 1000.0
+                    while len(pending) < max_batch:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        connection.process_data_events(time_limit=remaining)
+                    batch, pending[:] = pending[:max_batch], pending[max_batch:]
+                    handle(channel, queue_name, batch)
+            finally:
+                self.close_connection(connection)
+        threading.Thread(target=self.run_with_recovery, args=(consume,), daemon=True).start()
+
+    def close_connection(self, connection):
+        # A failed consume must not leave its connection open: it would keep an
+        # exclusive queue and unacked deliveries until the heartbeat expires.
+        if connection.is_open:
+            try:
+                connection.close()
+            except Exception as e:
+                log.debug("%s could not close connection: %r", self.consumer, e)
+
+    def run_with_recovery(self, consume):
+        # Keeps a consumer alive across dropped connections and closed channels:
+        # every reconnect re-declares the queue, bindings and retry topology.
+        # Unacked deliveries from the lost channel are redelivered by the broker.
+        backoff = Backoff()
+        while True:
+            try:
+                consume(backoff)
+                log.warning("%s consumer on %s stopped, restarting", self.consumer, self.exchange)
+            except Exception as e:
+                delay = backoff.next_delay()
+                log.warning("%s consumer on %s failed: %r - reconnecting in %.1fs", self.consumer, self.exchange, e, delay)
+                time.sleep(delay)
+
+    def queue_arguments(self):
+        arguments = {}
+        if self.queue_ttl_ms:
+            arguments['x-message-ttl'] = self.queue_ttl_ms
+        if self.queue_max_length:
+            arguments['x-max-length'] = self.queue_max_length
+        return arguments
 
-            channel = connection.channel()
-            channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
+    def bind_queue(self, channel):
+        channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
+        if self.group:
+            result = channel.queue_declare(queue=self.retry_name(), durable=True, arguments=self.queue_arguments())
+        else:
             result = channel.queue_declare(queue='', exclusive=True)
-            queue_name = result.method.queue
-            channel.queue_bind(exchange=self.exchange, queue=queue_name, routing_key=self.routing_key)
+        queue_name = result.method.queue
+        channel.queue_bind(exchange=self.exchange, queue=queue_name, routing_key=self.routing_key)
+        self.declare_retry_topology(channel, queue_name)
+
+        log.info("Bound to queue %s with routing_key %s, waiting for messages...", queue_name, self.routing_key)
+        return queue_name
+
+    def retry_name(self):
+        name = f"{self.group or self.consumer}.{self.exchange}"
+        return f"{name}.{self.routing_key}" if self.routing_key else name
+
+    def retry_delay(self, attempt):
+        return RETRY_DELAY_MS * 2 ** attempt
 
-            print(f"Bound to queue {queue_name} with routing_key {self.routing_key}, waiting for messages...", flush=True)
+    def declare_retry_topology(self, channel, queue_name):
+        # Failed messages go to a headers exchange that picks a delay queue by
+        # its TTL. When the TTL expires the delay queue dead-letters back
+        # through the return exchange, keeping the routing key (our queue
+        # name), so only this consumer's queue sees the retry. Messages that
+        # exhaust their retries are parked in the .dlq queue.
+        name = self.retry_name()
+        channel.exchange_declare(exchange=f"{name}.delay", exchange_type='headers', durable=True)
+        channel.exchange_declare(exchange=f"{name}.return", exchange_type='direct', durable=True)
+        channel.queue_bind(exchange=f"{name}.return", queue=queue_name, routing_key=queue_name)
+        for attempt in range(MAX_RETRIES):
+            delay = self.retry_delay(attempt)
+            delay_queue = f"{name}.delay.{delay}ms"
+            channel.queue_declare(queue=delay_queue, durable=True, arguments={
+                'x-message-ttl': delay,
+                'x-dead-letter-exchange': f"{name}.return"
+            })
+            channel.queue_bind(exchange=f"{name}.delay", queue=delay_queue, arguments={'x-match': 'all', 'retry-delay': delay})
+        channel.queue_declare(queue=f"{name}.dlq", durable=True)
 
-            channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
-            channel.start_consuming()
-        threading.Thread(target=consume, daemon=True).start()
+    def retry_or_dead_letter(self, channel, queue_name, properties, body, error):
+        headers = dict(properties.headers or {})
+        attempt = int(headers.get('x-retry-count', 0))
+        name = self.retry_name()
+        if attempt < MAX_RETRIES:
+            delay = self.retry_delay(attempt)
+            headers.update({'x-retry-count': attempt + 1, 'retry-delay': delay})
+            channel.basic_publish(exchange=f"{name}.delay", routing_key=queue_name, body=body,
+                                  properties=pika.BasicProperties(content_type=properties.content_type, headers=headers, delivery_mode=2))
+            log.info("%s scheduled retry %d/%d in %dms", self.consumer, attempt + 1, MAX_RETRIES, delay)
+        else:
+            headers.update({
+                'x-original-exchange': self.exchange,
+                'x-original-routing-key': self.routing_key,
+                'x-original-queue': queue_name,
+                'x-error': str(error)[:1000]
+            })
+            channel.basic_publish(exchange='', routing_key=f"{name}.dlq", body=body,
+                                  properties=pika.BasicProperties(content_type=properties.content_type, headers=headers, delivery_mode=2))
+            log.error("%s dead-lettered message after %d retries to %s.dlq: %s", self.consumer, attempt, name, error)
+
+    def publisher(self):
+        key = (self.host, self.port, self.username)
+        return PublisherConnection.get(key, lambda: self.connect_with_retry(self.host, self.port, timeout=PUBLISH_TIMEOUT))
+
+    def serialize(self, messageType, body):
+        message = {
+            "type": messageType,
+            "data": body,
+            "sender": self.consumer
+        }
+        return self.codec.encode(message)
+
+    def properties(self):
+        return pika.BasicProperties(content_type=self.codec.content_type)
+
+    def publish(self, body, routing_key=None, properties=None):
+        # Publishes an already-encoded body over the pooled publisher connection,
+        # optionally to a routing key other than the one this client was built with.
+        routing_key = self.routing_key if routing_key is None else routing_key
+        self.publisher().publish(self.exchange, self.exchange_type, routing_key, body, properties or self.properties())
+
+    def sendMessageAsync(self, messageType, body):
+        with self.async_publisher_lock:
+            if self.async_publisher is None:
+                self.async_publisher = AsyncPublisher(lambda: self.connect_with_retry(self.host, self.port), self.exchange, self.exchange_type)
+        return self.async_publisher.submit(self.routing_key, self.serialize(messageType, body), self.properties())
 
     def sendMessage(self, messageType, body):
-        print("Send function called", flush=True)
         try:
-            connection = self.connect_with_retry(self.host, self.port)
-            channel = connection.channel()
-            channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
-            
-            message = {
-                "type": messageType,
-                "data": body,
-                "sender": self.consumer
-            }
-            
-            serialized_body = json.dumps(message)
-            channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=serialized_body)
-            print(f"Published message to exchange {self.exchange} with routing_key {self.routing_key}: {messageType}", flush=True)
-            connection.close()
+            serialized_body = self.serialize(messageType, body)
+
+            if PUBLISHER_POOL:
+                self.publish(serialized_body)
+            else:
+                connection = self.connect_with_retry(self.host, self.port, timeout=PUBLISH_TIMEOUT)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
+                channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=serialized_body, properties=self.properties())
+                connection.close()
+
+            log.info("Published message to exchange %s with routing_key %s: %s", self.exchange, self.routing_key, messageType, extra=log_utils.SAMPLED)
             return f'Message sent: {messageType}'
         except Exception as e:
-            print(f"ERROR in sendMessage: {str(e)}", flush=True)
-            import traceback
-            traceback.print_exc()
+            log.exception("ERROR in sendMessage: %s", e)
             raise
 
-    def connect_with_retry(self, host, port, interval=5):
+    def connect_with_retry(self, host, port, timeout=None):
+        # Retries with jittered exponential backoff. With a timeout, gives up and
+        # re-raises once the next attempt would start past the deadline.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        backoff = Backoff()
+        credentials = pika.PlainCredentials(self.username, self.password)
         while True:
             try:
-                credentials = pika.PlainCredentials(self.username, self.password)
-                return pika.BlockingConnection(pika.ConnectionParameters(host, port=port, credentials=credentials))
+                if BROKER != 'amqp':
+                    return memory_broker.connect(BROKER, host)
+                parameters = pika.ConnectionParameters(
+                    host, port=port, credentials=credentials, connection_attempts=1,
+                    socket_timeout=timeout or 10, blocked_connection_timeout=timeout or 60
+                )
+                return pika.BlockingConnection(parameters)
             except pika.exceptions.AMQPConnectionError as e:
-                print(f"RabbitMQ not ready at {host}:{port} - retrying in {interval}s: {e}")
-                time.sleep(interval)
\ No newline at end of file
+                delay = backoff.next_delay()
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    log.error("RabbitMQ not reachable at %s:%s within %ss: %r", host, port, timeout, e)
+                    raise
+                log.warning("RabbitMQ not ready at %s:%s - retrying in %.1fs: %r", host, port, delay, e)
+                time.sleep(delay)
+
+install_sigterm_handler()